@@ -0,0 +1,132 @@
+
+import os, json, hashlib, pickle
+from typing import Any, Dict, FrozenSet, NamedTuple, Optional, Tuple
+
+# checklist.json is validated and compiled once into an immutable, indexed structure.
+# The result is pickled under cache/ together with the source file's mtime, size and sha256:
+# an unchanged file is not even read on the next launch, a touched-but-identical one is
+# only hashed. content_hash is the key of the checklist template in the DB.
+
+CACHE_FORMAT = 1
+
+class ChecklistError(ValueError):
+    pass
+
+class ChecklistItem(NamedTuple):
+    block_index: int
+    item_index: int
+    text: str
+    hint: Optional[str]
+    critical: bool
+
+class CompiledChecklist(NamedTuple):
+    version: str
+    updated_at: str
+    finish_message: str
+    content_hash: str
+    block_titles: Tuple[str, ...]
+    blocks: Tuple[Tuple[ChecklistItem, ...], ...]   # items per block
+    items: Tuple[ChecklistItem, ...]                # all items in block/item order
+    critical: FrozenSet[Tuple[int, int]]            # (block_index, item_index) of critical items
+
+    def item(self, block_index: int, item_index: int) -> ChecklistItem:
+        return self.blocks[block_index][item_index]
+
+    def is_critical(self, block_index: int, item_index: int) -> bool:
+        return (block_index, item_index) in self.critical
+
+DEFAULT_FINISH_MESSAGE = "Разрешена фрезеровка детали..."
+
+def content_hash(data: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def _text(value: Any, where: str, optional: bool = False) -> Optional[str]:
+    if value is None and optional:
+        return None
+    if not isinstance(value, str) or not value.strip():
+        raise ChecklistError(f"{where}: ожидается непустая строка")
+    return value
+
+def compile_checklist(data: Any) -> CompiledChecklist:
+    if not isinstance(data, dict):
+        raise ChecklistError("checklist: ожидается объект")
+    blocks = data.get("blocks")
+    if not isinstance(blocks, list) or not blocks:
+        raise ChecklistError("blocks: ожидается непустой список")
+    titles, compiled, critical = [], [], set()
+    for bi, block in enumerate(blocks):
+        where = f"blocks[{bi}]"
+        if not isinstance(block, dict):
+            raise ChecklistError(f"{where}: ожидается объект")
+        titles.append(_text(block.get("title"), f"{where}.title"))
+        items = block.get("items")
+        if not isinstance(items, list) or not items:
+            raise ChecklistError(f"{where}.items: ожидается непустой список")
+        row = []
+        for ii, item in enumerate(items):
+            iwhere = f"{where}.items[{ii}]"
+            if not isinstance(item, dict):
+                raise ChecklistError(f"{iwhere}: ожидается объект")
+            flag = item.get("critical", False)
+            if not isinstance(flag, bool):
+                raise ChecklistError(f"{iwhere}.critical: ожидается true/false")
+            row.append(ChecklistItem(bi, ii, _text(item.get("text"), f"{iwhere}.text"),
+                                     _text(item.get("hint"), f"{iwhere}.hint", optional=True), flag))
+            if flag:
+                critical.add((bi, ii))
+        compiled.append(tuple(row))
+    finish_message = data.get("finish_message") or DEFAULT_FINISH_MESSAGE
+    _text(finish_message, "finish_message")
+    return CompiledChecklist(
+        version=str(data.get("version", "1.0")),
+        updated_at=str(data.get("updated_at", "")),
+        finish_message=finish_message,
+        content_hash=content_hash(data),
+        block_titles=tuple(titles),
+        blocks=tuple(compiled),
+        items=tuple(it for row in compiled for it in row),
+        critical=frozenset(critical),
+    )
+
+def _read_cache(cache_path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(cache_path, "rb") as f:
+            cached = pickle.load(f)
+    except Exception:
+        # missing, truncated or written by another version: rebuilt below
+        return None
+    if not isinstance(cached, dict) or cached.get("format") != CACHE_FORMAT:
+        return None
+    return cached
+
+def _write_cache(cache_path: str, cached: Dict[str, Any]):
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    tmp = cache_path + ".tmp"
+    try:
+        with open(tmp, "wb") as f:
+            pickle.dump(cached, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_path)
+    except OSError:
+        # read-only install: the app still works, it just compiles on every launch
+        pass
+
+def load_checklist(path: str, cache_path: Optional[str] = None) -> CompiledChecklist:
+    st = os.stat(path)
+    cached = _read_cache(cache_path) if cache_path else None
+    if cached and cached["mtime_ns"] == st.st_mtime_ns and cached["size"] == st.st_size:
+        return cached["checklist"]
+    with open(path, "rb") as f:
+        raw = f.read()
+    file_hash = hashlib.sha256(raw).hexdigest()
+    if cached and cached["file_hash"] == file_hash:
+        checklist = cached["checklist"]
+    else:
+        try:
+            data = json.loads(raw.decode("utf-8"))
+        except ValueError as e:
+            raise ChecklistError(f"{os.path.basename(path)}: {e}") from e
+        checklist = compile_checklist(data)
+    if cache_path:
+        _write_cache(cache_path, {"format": CACHE_FORMAT, "mtime_ns": st.st_mtime_ns, "size": st.st_size,
+                                  "file_hash": file_hash, "checklist": checklist})
+    return checklist
@@ -1,11 +1,32 @@
 
-import sqlite3, json, time, os
-from typing import Any, Dict, Optional, List, Tuple
+import sqlite3, json, time, os, re, threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, List, Tuple
 
 DB_NAME = "app.db"
 
+# Durability: WAL + synchronous=NORMAL fsyncs only on checkpoints (a power cut may lose
+# the last commits but never corrupts the DB); DELETE/FULL is the SQLite default.
+JOURNAL_MODES = ("DELETE", "TRUNCATE", "PERSIST", "WAL")
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+# Buffered audit log: DB.log() queues rows, a background writer inserts them in one
+# transaction when LOG_FLUSH_SIZE rows are pending or LOG_FLUSH_INTERVAL seconds passed.
+# AUDIT rows are written and durably committed before log() returns: with WAL +
+# synchronous=NORMAL the WAL file is fsynced after that commit.
+# An AUDIT logged inside transaction() belongs to that unit - durable when the outermost
+# block commits, rolled back together with the change it audits.
+LOG_FLUSH_SIZE = 50
+LOG_FLUSH_INTERVAL = 2.0
+
+# a photo whose capture-time ingest failed this many times is left to the report (original file)
+INGEST_MAX_ATTEMPTS = 3
+
+# Migration 1: the schema as it stood when user_version tracking was introduced - not the
+# original v1, it already has the photo ingest columns and the jobs table (migration 2 adds
+# the columns to files older than that). Fresh installs run it and then every later migration,
+# so the current schema is SCHEMA plus MIGRATIONS. Released: changes go to MIGRATIONS below.
 SCHEMA = """
-PRAGMA foreign_keys = ON;
 CREATE TABLE IF NOT EXISTS settings (
   key TEXT PRIMARY KEY,
   value TEXT
@@ -48,7 +69,14 @@ CREATE TABLE IF NOT EXISTS photos (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   step_id INTEGER NOT NULL REFERENCES steps(id) ON DELETE CASCADE,
   file_path TEXT NOT NULL,
-  added_at INTEGER NOT NULL
+  added_at INTEGER NOT NULL,
+  -- filled by the capture-time ingest (photo_ingest.py)
+  norm_path TEXT,          -- EXIF-oriented report-resolution JPEG
+  thumb_path TEXT,
+  width INTEGER,
+  height INTEGER,
+  byte_size INTEGER,
+  sha256 TEXT
 );
 CREATE TABLE IF NOT EXISTS logs (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -64,142 +92,918 @@ CREATE TABLE IF NOT EXISTS reports (
   file_path TEXT NOT NULL,
   created_at INTEGER NOT NULL
 );
+CREATE TABLE IF NOT EXISTS jobs (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  kind TEXT NOT NULL,      -- e.g. 'report','email'
+  params TEXT,             -- JSON string with handler kwargs
+  status TEXT NOT NULL DEFAULT 'queued', -- queued|running|done|failed|cancelled
+  attempts INTEGER NOT NULL DEFAULT 0,
+  result TEXT,             -- JSON string returned by handler
+  error TEXT,
+  created_at INTEGER NOT NULL,
+  updated_at INTEGER
+);
+"""
+
+def _add_missing_columns(cur, table: str, columns: List[Tuple[str, str]]):
+    existing = {r[1] for r in cur.execute(f"PRAGMA table_info({table})")}
+    for column, decl in columns:
+        if column not in existing:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def _migrate_photo_ingest_columns(cur):
+    # databases created before schema versioning may lack the ingest columns
+    _add_missing_columns(cur, "photos", [("norm_path", "TEXT"), ("thumb_path", "TEXT"), ("width", "INTEGER"),
+                                         ("height", "INTEGER"), ("byte_size", "INTEGER"), ("sha256", "TEXT")])
+
+# Full-text index over report history, one row per session (rowid = sessions.id).
+# Kept in sync by triggers; step notes and override master names are re-aggregated per session.
+HISTORY_FTS_NOTES = "(SELECT coalesce(group_concat(note, ' '), '') FROM steps WHERE session_id={sid} AND note IS NOT NULL AND note<>'')"
+HISTORY_FTS_MASTERS = "(SELECT coalesce(group_concat(DISTINCT override_master_name), '') FROM steps WHERE session_id={sid})"
+HISTORY_FTS_STEP_TRIGGER = f"""
+CREATE TRIGGER trg_history_fts_step_upd AFTER UPDATE OF note, override_master_name ON steps
+WHEN NEW.note IS NOT OLD.note OR NEW.override_master_name IS NOT OLD.override_master_name BEGIN
+  UPDATE history_fts SET notes={HISTORY_FTS_NOTES.format(sid="NEW.session_id")},
+                         masters={HISTORY_FTS_MASTERS.format(sid="NEW.session_id")}
+  WHERE rowid=NEW.session_id;
+END;
+"""
+HISTORY_FTS = f"""
+CREATE VIRTUAL TABLE history_fts USING fts5(order_no, operator_name, notes, masters, tokenize='unicode61 remove_diacritics 2');
+CREATE TRIGGER trg_history_fts_session_ins AFTER INSERT ON sessions BEGIN
+  INSERT INTO history_fts(rowid, order_no, operator_name, notes, masters) VALUES (NEW.id, NEW.order_no, NEW.operator_name, '', '');
+END;
+CREATE TRIGGER trg_history_fts_session_upd AFTER UPDATE OF order_no, operator_name ON sessions BEGIN
+  UPDATE history_fts SET order_no=NEW.order_no, operator_name=NEW.operator_name WHERE rowid=NEW.id;
+END;
+CREATE TRIGGER trg_history_fts_session_del AFTER DELETE ON sessions BEGIN
+  DELETE FROM history_fts WHERE rowid=OLD.id;
+END;
+{HISTORY_FTS_STEP_TRIGGER.strip()}
+INSERT INTO history_fts(rowid, order_no, operator_name, notes, masters)
+  SELECT s.id, s.order_no, s.operator_name, {HISTORY_FTS_NOTES.format(sid="s.id")}, {HISTORY_FTS_MASTERS.format(sid="s.id")}
+  FROM sessions s;
+"""
+
+def _migrate_history_fts(cur):
+    # SQLite builds without FTS5 keep the LIKE search in list_reports
+    if "ENABLE_FTS5" not in {r[0] for r in cur.execute("PRAGMA compile_options")}:
+        return
+    for stmt in _split_sql(HISTORY_FTS):
+        cur.execute(stmt)
+
+def _split_sql(script: str) -> List[str]:
+    # statement splitter for callable migrations (cursor.execute takes one statement)
+    stmts, buf = [], ""
+    for line in script.splitlines(keepends=True):
+        buf += line
+        if sqlite3.complete_statement(buf):
+            stmts.append(buf.strip())
+            buf = ""
+    return stmts
+
+def fts_query(text: str) -> Optional[str]:
+    # user input -> FTS5 MATCH expression: every word as a quoted prefix term, all required
+    words = re.findall(r"\w+", text or "")
+    return " ".join(f'"{w}"*' for w in words) or None
+
+# Checklist templates: each checklist.json content (keyed by hash) is stored once,
+# session steps reference its items instead of copying text/hint.
+CHECKLIST_TEMPLATES = """
+CREATE TABLE checklist_templates (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  version TEXT NOT NULL,
+  content_hash TEXT NOT NULL UNIQUE,
+  created_at INTEGER NOT NULL
+);
+CREATE TABLE checklist_items (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  template_id INTEGER NOT NULL REFERENCES checklist_templates(id),
+  block_index INTEGER NOT NULL,
+  item_index INTEGER NOT NULL,
+  text TEXT NOT NULL,
+  hint TEXT,
+  critical INTEGER NOT NULL DEFAULT 0,
+  UNIQUE(template_id, block_index, item_index)
+);
+CREATE TABLE steps_v6 (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+  block_index INTEGER NOT NULL,
+  item_index INTEGER NOT NULL,
+  template_item_id INTEGER REFERENCES checklist_items(id),
+  text TEXT,               -- own copy only for sessions started before templates
+  hint TEXT,
+  critical INTEGER NOT NULL DEFAULT 0,
+  status TEXT NOT NULL DEFAULT 'pending', -- pending|in_progress|done|failed
+  started_at INTEGER,
+  completed_at INTEGER,
+  duration_sec INTEGER,
+  note TEXT,
+  override_by_master INTEGER NOT NULL DEFAULT 0,
+  override_master_name TEXT
+);
+INSERT INTO steps_v6(id, session_id, block_index, item_index, text, hint, critical, status, started_at,
+                     completed_at, duration_sec, note, override_by_master, override_master_name)
+  SELECT id, session_id, block_index, item_index, text, hint, critical, status, started_at,
+         completed_at, duration_sec, note, override_by_master, override_master_name FROM steps;
+DROP TABLE steps;
+ALTER TABLE steps_v6 RENAME TO steps;
+CREATE UNIQUE INDEX idx_steps_unique ON steps(session_id, block_index, item_index);
+"""
+
+def _migrate_checklist_templates(cur):
+    # steps.text/hint become nullable: SQLite needs a table rebuild (foreign keys are off
+    # during migrations, so dropping the old table does not cascade to photos/versions)
+    has_fts = cur.execute("SELECT 1 FROM sqlite_master WHERE name='history_fts'").fetchone() is not None
+    for stmt in _split_sql(CHECKLIST_TEMPLATES):
+        cur.execute(stmt)
+    if has_fts:
+        cur.execute(HISTORY_FTS_STEP_TRIGGER.strip())
+
+# Schema migrations, applied in order by DB._migrate() and tracked in PRAGMA user_version.
+# Each step runs in its own transaction; append new steps, never change released ones.
+MIGRATIONS = [
+    (1, SCHEMA),
+    (2, _migrate_photo_ingest_columns),
+    (3, """
+CREATE INDEX IF NOT EXISTS idx_photos_step ON photos(step_id);
+CREATE INDEX IF NOT EXISTS idx_step_versions_step ON step_versions(step_id, changed_at);
+CREATE INDEX IF NOT EXISTS idx_reports_session ON reports(session_id);
+CREATE INDEX IF NOT EXISTS idx_sessions_status ON sessions(status, id);
+CREATE INDEX IF NOT EXISTS idx_logs_ts ON logs(ts);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
+"""),
+    (4, _migrate_history_fts),
+    (5, "CREATE INDEX IF NOT EXISTS idx_reports_created ON reports(created_at, id);"),
+    (6, _migrate_checklist_templates),
+    (7, """
+CREATE TABLE IF NOT EXISTS outbox (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  subject TEXT NOT NULL,
+  body TEXT,
+  attachments TEXT,                    -- JSON list of file paths, read at send time
+  log_action TEXT NOT NULL DEFAULT 'email_send',
+  status TEXT NOT NULL DEFAULT 'queued',  -- queued|sent|failed
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_attempt_at INTEGER NOT NULL DEFAULT 0,
+  last_error TEXT,
+  created_at INTEGER NOT NULL,
+  sent_at INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox(status, next_attempt_at);
+"""),
+    (8, """
+CREATE TABLE IF NOT EXISTS digests (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  period_start INTEGER NOT NULL,
+  period_end INTEGER NOT NULL,
+  report_count INTEGER NOT NULL,
+  files TEXT,                          -- JSON list of the archives queued for sending
+  created_at INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS digest_reports (
+  report_id INTEGER PRIMARY KEY REFERENCES reports(id) ON DELETE CASCADE,
+  digest_id INTEGER NOT NULL REFERENCES digests(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_digest_reports_digest ON digest_reports(digest_id);
+"""),
+    (9, """
+ALTER TABLE photos ADD COLUMN ingest_attempts INTEGER NOT NULL DEFAULT 0;  -- failed ingest runs
+ALTER TABLE photos ADD COLUMN ingest_error TEXT;
+"""),
+]
+
+# steps joined with their template item; legacy rows keep their own text/hint
+STEP_SELECT = """
+  SELECT st.id, st.session_id, st.block_index, st.item_index, st.template_item_id,
+         COALESCE(ci.text, st.text) AS text, COALESCE(ci.hint, st.hint) AS hint, st.critical,
+         st.status, st.started_at, st.completed_at, st.duration_sec, st.note,
+         st.override_by_master, st.override_master_name
+  FROM steps st LEFT JOIN checklist_items ci ON ci.id=st.template_item_id
 """
 
 class DB:
-    def __init__(self, path: str):
+    def __init__(self, path: str, journal_mode: Optional[str] = None, synchronous: Optional[str] = None):
+        # journal_mode / synchronous: explicit (tools/bench_db.py) or from settings db_journal_mode /
+        # db_synchronous (applied at the next start), default WAL / NORMAL
         self.path = path
         self.conn = sqlite3.connect(self.path, check_same_thread=False)
         self.conn.row_factory = sqlite3.Row
+        stored = self._stored_settings(("db_journal_mode", "db_synchronous"))
+        bad_settings: Dict[str, str] = {}
+
+        def mode(name: str, value: Optional[str], allowed: Tuple[str, ...], default: str) -> str:
+            if value is not None:
+                if value.upper() not in allowed:
+                    raise ValueError(f"{name} must be one of {allowed}")
+                return value.upper()
+            value = (stored.get("db_" + name) or "").strip().upper()
+            if value and value not in allowed:
+                # a typo in settings must not keep the app from starting
+                bad_settings["db_" + name] = value
+                value = ""
+            return value or default
+
+        journal_mode = mode("journal_mode", journal_mode, JOURNAL_MODES, "WAL")
+        synchronous = mode("synchronous", synchronous, SYNCHRONOUS_MODES, "NORMAL")
+        # effective for new databases only; existing ones are converted by reclaim_space(full=True)
+        self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.journal_mode = self.conn.execute(f"PRAGMA journal_mode={journal_mode}").fetchone()[0].upper()
+        self.synchronous = synchronous
+        self.conn.execute(f"PRAGMA synchronous={synchronous}")
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        # connection is shared with background job workers
+        self.lock = threading.RLock()
+        self._tx_depth = 0
+        self._tx_durable = False  # an AUDIT row was written in the open transaction
+        self._after_commit: List[Callable[[], None]] = []
+        self._settings: Dict[str, Optional[str]] = {}
+        self._template_ids: Dict[str, int] = {}
+        self._log_buffer: List[Tuple[int, str, str, str]] = []
+        self._log_cond = threading.Condition()
+        self._log_thread: Optional[threading.Thread] = None
+        self._log_stop = False
         self._init()
+        if bad_settings:
+            self.log("WARN", "db_config", {"invalid": bad_settings, "journal_mode": self.journal_mode,
+                                           "synchronous": self.synchronous})
 
-    def _init(self):
-        cur = self.conn.cursor()
-        cur.executescript(SCHEMA)
+    def _stored_settings(self, keys: Tuple[str, ...]) -> Dict[str, Optional[str]]:
+        # read before the pragmas are applied and the schema is migrated
+        try:
+            rows = self.conn.execute(f"SELECT key, value FROM settings WHERE key IN ({','.join('?' * len(keys))})",
+                                     keys).fetchall()
+        except sqlite3.OperationalError:
+            return {}  # new database
+        return {r["key"]: r["value"] for r in rows}
+
+    @contextmanager
+    def transaction(self):
+        # Groups the writes of several DB methods into one commit (one fsync).
+        # Nested blocks join the outermost one; an exception rolls the whole unit back.
+        with self.lock:
+            self._tx_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._tx_depth -= 1
+                if self._tx_depth == 0:
+                    self._tx_durable = False
+                    self._after_commit.clear()
+                    self.conn.rollback()
+                    # cached settings may hold values of the rolled back writes
+                    self._load_settings()
+                raise
+            self._tx_depth -= 1
+            if self._tx_depth == 0:
+                if self._tx_durable:
+                    self._tx_durable = False
+                    self._durable_commit()
+                else:
+                    self.conn.commit()
+                callbacks, self._after_commit = self._after_commit, []
+                for fn in callbacks:
+                    fn()
+
+    def after_commit(self, fn: Callable[[], None]):
+        # For in-memory copies of DB state (SessionState): fn runs once the open transaction
+        # commits and is dropped if it rolls back; outside a transaction the write is already
+        # committed and fn runs at once.
+        with self.lock:
+            if self._tx_depth:
+                self._after_commit.append(fn)
+                return
+        fn()
+
+    def _commit(self):
+        if self._tx_depth == 0:
+            self.conn.commit()
+
+    def _durable_commit(self):
+        # commit that survives a power cut once it returns (AUDIT rows)
         self.conn.commit()
-        if self.get_setting("report_seq") is None:
-            self.set_setting("report_seq", "0")
+        if self.journal_mode == "WAL" and self.synchronous == "NORMAL":
+            # NORMAL writes the commit to the WAL without syncing it: sync the file ourselves.
+            # Not a checkpoint - that would wait on readers holding an older snapshot.
+            fd = os.open(self.path + "-wal", os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _init(self):
+        with self.lock:
+            self._migrate()
+            self.has_fts = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='history_fts'").fetchone() is not None
+            self._load_settings()
+            if self.get_setting("report_seq") is None:
+                self.set_setting("report_seq", "0")
+
+    def schema_version(self) -> int:
+        with self.lock:
+            return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def _migrate(self):
+        version = self.schema_version()
+        if version >= MIGRATIONS[-1][0]:
+            return
+        # table rebuilds must not cascade; checked with foreign_key_check before each commit
+        self.conn.execute("PRAGMA foreign_keys = OFF")
+        try:
+            self._apply_migrations(version)
+        finally:
+            self.conn.execute("PRAGMA foreign_keys = ON")
+
+    def _apply_migrations(self, version: int):
+        for target, step in MIGRATIONS:
+            if version >= target:
+                continue
+            cur = self.conn.cursor()
+            try:
+                cur.execute("BEGIN")
+                if callable(step):
+                    step(cur)
+                else:
+                    for stmt in _split_sql(step):
+                        cur.execute(stmt)
+                if cur.execute("PRAGMA foreign_key_check").fetchone() is not None:
+                    raise sqlite3.IntegrityError(f"migration {target}: foreign key check failed")
+                cur.execute(f"PRAGMA user_version={target}")
+                self.conn.commit()
+            except Exception:
+                if self.conn.in_transaction:
+                    self.conn.rollback()
+                raise
+            version = target
+
+    # ---------- Settings ----------
+    # The settings table is small and read on every screen: it is loaded once and
+    # kept in memory, writes go to the DB and the cache together.
+    def _load_settings(self):
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("SELECT key, value FROM settings")
+            self._settings = {r["key"]: r["value"] for r in cur.fetchall()}
 
     def get_setting(self, key: str) -> Optional[str]:
-        cur = self.conn.cursor()
-        cur.execute("SELECT value FROM settings WHERE key=?", (key,))
-        row = cur.fetchone()
-        return row["value"] if row else None
+        with self.lock:
+            return self._settings.get(key)
+
+    def get_settings(self, keys) -> Dict[str, Optional[str]]:
+        with self.lock:
+            return {k: self._settings.get(k) for k in keys}
 
     def set_setting(self, key: str, value: str):
-        cur = self.conn.cursor()
-        cur.execute("INSERT INTO settings(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", (key, value))
-        self.conn.commit()
+        self.set_settings({key: value})
+
+    def set_settings(self, values: Dict[str, str]):
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.executemany("INSERT INTO settings(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+                            list(values.items()))
+            self._commit()
+            self._settings.update(values)
 
     def bump_report_seq(self) -> int:
-        seq = int(self.get_setting("report_seq") or "0") + 1
-        self.set_setting("report_seq", str(seq))
-        return seq
+        with self.lock:
+            seq = int(self.get_setting("report_seq") or "0") + 1
+            self.set_setting("report_seq", str(seq))
+            return seq
 
     def create_session(self, order_no: str, operator_name: str) -> int:
-        ts = int(time.time())
-        cur = self.conn.cursor()
-        cur.execute("INSERT INTO sessions(order_no, operator_name, started_at) VALUES(?,?,?)",
-                    (order_no, operator_name, ts))
-        self.conn.commit()
-        return cur.lastrowid
+        with self.lock:
+            ts = int(time.time())
+            cur = self.conn.cursor()
+            cur.execute("INSERT INTO sessions(order_no, operator_name, started_at) VALUES(?,?,?)",
+                        (order_no, operator_name, ts))
+            self._commit()
+            return cur.lastrowid
 
     def get_active_session(self) -> Optional[sqlite3.Row]:
-        cur = self.conn.cursor()
-        cur.execute("SELECT * FROM sessions WHERE status='active' ORDER BY id DESC LIMIT 1")
-        return cur.fetchone()
-
-    def mark_session_completed(self, session_id: int):
-        ts = int(time.time())
-        cur = self.conn.cursor()
-        cur.execute("UPDATE sessions SET status='completed', completed_at=? WHERE id=?", (ts, session_id))
-        self.conn.commit()
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("SELECT * FROM sessions WHERE status='active' ORDER BY id DESC LIMIT 1")
+            return cur.fetchone()
+
+    def mark_session_completed(self, session_id: int, ts: Optional[int] = None):
+        with self.lock:
+            ts = int(time.time()) if ts is None else ts
+            cur = self.conn.cursor()
+            cur.execute("UPDATE sessions SET status='completed', completed_at=? WHERE id=?", (ts, session_id))
+            self._commit()
 
-    def ensure_steps_for_session(self, session_id: int, checklist: Dict[str, Any]):
-        cur = self.conn.cursor()
-        for bi, block in enumerate(checklist["blocks"]):
-            for ii, item in enumerate(block["items"]):
-                cur.execute("""
-                    INSERT OR IGNORE INTO steps(session_id, block_index, item_index, text, hint, critical)
+    def ensure_checklist_template(self, checklist) -> int:
+        # checklist: CompiledChecklist (checklist_loader); template stored on first use of its content
+        content_hash = checklist.content_hash
+        with self.lock:
+            template_id = self._template_ids.get(content_hash)
+            if template_id is not None:
+                return template_id
+            cur = self.conn.cursor()
+            row = cur.execute("SELECT id FROM checklist_templates WHERE content_hash=?", (content_hash,)).fetchone()
+            if row:
+                template_id = row["id"]
+            else:
+                cur.execute("INSERT INTO checklist_templates(version, content_hash, created_at) VALUES(?,?,?)",
+                            (checklist.version, content_hash, int(time.time())))
+                template_id = cur.lastrowid
+                cur.executemany("""
+                    INSERT INTO checklist_items(template_id, block_index, item_index, text, hint, critical)
                     VALUES(?,?,?,?,?,?)
-                """, (session_id, bi, ii, item["text"], item.get("hint"), 1 if item.get("critical") else 0))
-        self.conn.commit()
+                """, [(template_id, it.block_index, it.item_index, it.text, it.hint, 1 if it.critical else 0)
+                      for it in checklist.items])
+                self._commit()
+            # cached once committed: a rolled back transaction takes a new template row with it
+            self.after_commit(lambda: self._template_ids.__setitem__(content_hash, template_id))
+            return template_id
+
+    def ensure_steps_for_session(self, session_id: int, checklist):
+        with self.lock:
+            template_id = self.ensure_checklist_template(checklist)
+            cur = self.conn.cursor()
+            cur.execute("""
+                INSERT OR IGNORE INTO steps(session_id, block_index, item_index, template_item_id, critical)
+                SELECT ?, block_index, item_index, id, critical FROM checklist_items WHERE template_id=?
+            """, (session_id, template_id))
+            if cur.rowcount == 0 and cur.execute("SELECT 1 FROM steps WHERE session_id=? LIMIT 1",
+                                                 (session_id,)).fetchone() is None:
+                raise RuntimeError(f"checklist template {template_id} has no items, session {session_id} left without steps")
+            self._commit()
 
     def get_steps(self, session_id: int) -> List[sqlite3.Row]:
-        cur = self.conn.cursor()
-        cur.execute("SELECT * FROM steps WHERE session_id=? ORDER BY block_index, item_index", (session_id,))
-        return cur.fetchall()
-
-    def update_step_status(self, step_id: int, new_status: str, note: Optional[str] = None):
-        cur = self.conn.cursor()
-        cur.execute("SELECT status, started_at FROM steps WHERE id=?", (step_id,))
-        row = cur.fetchone()
-        old_status = row["status"] if row else None
-        now = int(time.time())
-        started_at = row["started_at"]
-
-        # if moving from pending to in_progress, set started_at
-        if new_status == "in_progress" and not started_at:
-            cur.execute("UPDATE steps SET status=?, started_at=? WHERE id=?", (new_status, now, step_id))
-        elif new_status in ("done", "failed"):
-            # set completed_at and duration
-            cur.execute("SELECT started_at FROM steps WHERE id=?", (step_id,))
-            srow = cur.fetchone()
-            s_at = srow["started_at"] if srow else None
-            if not s_at:
-                s_at = now
-                cur.execute("UPDATE steps SET started_at=? WHERE id=?", (s_at, step_id))
-            duration = max(0, now - s_at)
-            cur.execute("UPDATE steps SET status=?, completed_at=?, duration_sec=?, note=? WHERE id=?",
-                        (new_status, now, duration, note, step_id))
-        else:
-            cur.execute("UPDATE steps SET status=?, note=? WHERE id=?", (new_status, note, step_id))
-
-        # version trail
-        cur.execute("INSERT INTO step_versions(step_id, changed_at, old_status, new_status, note) VALUES(?,?,?,?,?)",
-                    (step_id, now, old_status, new_status, note))
-        self.conn.commit()
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute(STEP_SELECT + " WHERE st.session_id=? ORDER BY st.block_index, st.item_index", (session_id,))
+            return cur.fetchall()
+
+    def get_step(self, step_id: int) -> Optional[sqlite3.Row]:
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute(STEP_SELECT + " WHERE st.id=?", (step_id,))
+            return cur.fetchone()
+
+    def update_step_status(self, step_id: int, new_status: str, note: Optional[str] = None,
+                           prev: Optional[Tuple[Optional[str], Optional[int]]] = None) -> Dict[str, Any]:
+        # prev: (status, started_at) already known to the caller (SessionState) - skips the SELECT.
+        # Returns the columns written, so in-memory copies can be updated without re-reading.
+        with self.lock:
+            cur = self.conn.cursor()
+            if prev is None:
+                cur.execute("SELECT status, started_at FROM steps WHERE id=?", (step_id,))
+                row = cur.fetchone()
+                prev = (row["status"], row["started_at"]) if row else (None, None)
+            old_status, started_at = prev
+            now = int(time.time())
+
+            # if moving from pending to in_progress, set started_at
+            if new_status == "in_progress" and not started_at:
+                changes = {"status": new_status, "started_at": now}
+            elif new_status in ("done", "failed"):
+                # set completed_at and duration
+                s_at = started_at or now
+                changes = {"status": new_status, "started_at": s_at, "completed_at": now,
+                           "duration_sec": max(0, now - s_at), "note": note}
+            else:
+                changes = {"status": new_status, "note": note}
+            cols = ", ".join(f"{k}=?" for k in changes)
+            cur.execute(f"UPDATE steps SET {cols} WHERE id=?", (*changes.values(), step_id))
+
+            # version trail
+            cur.execute("INSERT INTO step_versions(step_id, changed_at, old_status, new_status, note) VALUES(?,?,?,?,?)",
+                        (step_id, now, old_status, new_status, note))
+            self._commit()
+            return changes
 
     def set_step_master_override(self, step_id: int, master_name: str):
-        cur = self.conn.cursor()
-        cur.execute("UPDATE steps SET override_by_master=1, override_master_name=? WHERE id=?", (master_name, step_id))
-        self.conn.commit()
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("UPDATE steps SET override_by_master=1, override_master_name=? WHERE id=?", (master_name, step_id))
+            self._commit()
 
-    def add_photo(self, step_id: int, file_path: str):
-        cur = self.conn.cursor()
-        cur.execute("INSERT INTO photos(step_id, file_path, added_at) VALUES(?,?,?)",
-                    (step_id, file_path, int(time.time())))
-        self.conn.commit()
+    def add_photo(self, step_id: int, file_path: str) -> int:
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("INSERT INTO photos(step_id, file_path, added_at) VALUES(?,?,?)",
+                        (step_id, file_path, int(time.time())))
+            self._commit()
+            return cur.lastrowid
+
+    def get_photo(self, photo_id: int) -> Optional[sqlite3.Row]:
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("SELECT * FROM photos WHERE id=?", (photo_id,))
+            return cur.fetchone()
+
+    def set_photo_derivatives(self, photo_id: int, norm_path: str, thumb_path: str, width: int, height: int,
+                              byte_size: int, sha256: str):
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("""
+                UPDATE photos SET norm_path=?, thumb_path=?, width=?, height=?, byte_size=?, sha256=?,
+                                  ingest_error=NULL WHERE id=?
+            """, (norm_path, thumb_path, width, height, byte_size, sha256, photo_id))
+            self._commit()
+
+    def set_photo_ingest_failed(self, photo_id: int, error: str):
+        with self.lock:
+            self.conn.execute("UPDATE photos SET ingest_attempts=ingest_attempts+1, ingest_error=? WHERE id=?",
+                              (error, photo_id))
+            self._commit()
+
+    def get_photos_pending_ingest(self, max_attempts: int = INGEST_MAX_ATTEMPTS) -> List[sqlite3.Row]:
+        # only the active session: older photos are already baked into their reports.
+        # Photos that failed max_attempts times (corrupt file, gone) are not queued again.
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("""
+              SELECT p.* FROM photos p
+              JOIN steps st ON st.id=p.step_id
+              JOIN sessions s ON s.id=st.session_id
+              WHERE p.norm_path IS NULL AND p.ingest_attempts < ? AND s.status='active' ORDER BY p.id
+            """, (max_attempts,))
+            return cur.fetchall()
 
     def get_photos_for_step(self, step_id: int) -> List[sqlite3.Row]:
-        cur = self.conn.cursor()
-        cur.execute("SELECT * FROM photos WHERE step_id=? ORDER BY id", (step_id,))
-        return cur.fetchall()
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("SELECT * FROM photos WHERE step_id=? ORDER BY id", (step_id,))
+            return cur.fetchall()
 
+    # ---------- Logs ----------
     def log(self, level: str, action: str, details: Dict[str, Any]):
-        cur = self.conn.cursor()
-        cur.execute("INSERT INTO logs(ts, level, action, details) VALUES(?,?,?,?)",
-                    (int(time.time()), level, action, json.dumps(details, ensure_ascii=False)))
-        self.conn.commit()
+        row = (int(time.time()), level, action, json.dumps(details, ensure_ascii=False))
+        if level == "AUDIT":
+            with self.lock:
+                if self._tx_depth:
+                    # part of the caller's unit, see the comment at LOG_FLUSH_SIZE
+                    self.conn.execute("INSERT INTO logs(ts, level, action, details) VALUES(?,?,?,?)", row)
+                    self._tx_durable = True
+                else:
+                    self.flush_logs(audit=row)
+            return
+        with self._log_cond:
+            self._log_buffer.append(row)
+            if self._log_thread is None:
+                self._log_stop = False
+                self._log_thread = threading.Thread(target=self._log_writer, name="log-writer", daemon=True)
+                self._log_thread.start()
+            if len(self._log_buffer) >= LOG_FLUSH_SIZE:
+                self._log_cond.notify()
+
+    def flush_logs(self, audit: Optional[Tuple[int, str, str, str]] = None):
+        # audit: AUDIT row written after the buffered ones, the commit is then made durable.
+        # lock order: self.lock, then _log_cond (log() only takes _log_cond for buffered rows)
+        with self.lock:
+            with self._log_cond:
+                rows, self._log_buffer = self._log_buffer, []
+            if not rows and audit is None:
+                return
+            try:
+                self.conn.executemany("INSERT INTO logs(ts, level, action, details) VALUES(?,?,?,?)",
+                                      rows + ([audit] if audit else []))
+                if audit and not self._tx_depth:
+                    self._durable_commit()
+                else:
+                    self._commit()
+            except sqlite3.Error:
+                if self._tx_depth == 0:
+                    self.conn.rollback()
+                with self._log_cond:
+                    self._log_buffer[:0] = rows
+                raise
+
+    def stop_log_writer(self):
+        # app stop: write what is pending and end the writer thread
+        with self._log_cond:
+            thread, self._log_thread = self._log_thread, None
+            self._log_stop = True
+            self._log_cond.notify()
+        if thread is not None:
+            thread.join(timeout=5)
+        self.flush_logs()
+
+    def _log_writer(self):
+        while True:
+            with self._log_cond:
+                self._log_cond.wait_for(lambda: self._log_stop or len(self._log_buffer) >= LOG_FLUSH_SIZE,
+                                        timeout=LOG_FLUSH_INTERVAL)
+                stop = self._log_stop
+            try:
+                self.flush_logs()
+            except sqlite3.Error:
+                # keep the writer alive (e.g. "database is locked"); rows are retried with the next batch
+                pass
+            if stop:
+                return
+
+    @staticmethod
+    def _log_filter(since: Optional[int], until: Optional[int], levels=None, actions=None) -> Tuple[str, Tuple]:
+        where, args = [], ()
+        if since is not None:
+            where.append("ts >= ?")
+            args += (since,)
+        if until is not None:
+            where.append("ts < ?")
+            args += (until,)
+        if levels:
+            where.append(f"level IN ({','.join('?' * len(levels))})")
+            args += tuple(levels)
+        if actions:
+            where.append(f"action IN ({','.join('?' * len(actions))})")
+            args += tuple(actions)
+        return ("WHERE " + " AND ".join(where) if where else ""), args
+
+    def count_logs(self, since: Optional[int] = None, until: Optional[int] = None, levels=None, actions=None) -> int:
+        where, args = self._log_filter(since, until, levels, actions)
+        with self.lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM logs {where}", args).fetchone()[0]
+
+    def iter_logs(self, since: Optional[int] = None, until: Optional[int] = None, levels=None, actions=None,
+                  batch_size: int = 500):
+        # Streams matching log rows newest first. Each batch is one short keyset read
+        # (id below the last row of the previous batch): no read transaction stays open
+        # across the export, so writers are not locked out (rollback journal) and WAL
+        # checkpoints are not held back. Rows logged during the export are not included.
+        where, args = self._log_filter(since, until, levels, actions)
+        where = where + " AND id < ?" if where else "WHERE id < ?"
+        last_id = None
+        while True:
+            with self.lock:
+                if last_id is None:
+                    last_id = (self.conn.execute("SELECT MAX(id) FROM logs").fetchone()[0] or 0) + 1
+                rows = self.conn.execute(f"SELECT id, ts, level, action, details FROM logs {where} "
+                                         f"ORDER BY id DESC LIMIT ?", args + (last_id, batch_size)).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last_id = rows[-1]["id"]
 
     def add_report(self, session_id: int, seq: int, file_path: str):
-        cur = self.conn.cursor()
-        cur.execute("INSERT INTO reports(session_id, seq, file_path, created_at) VALUES(?,?,?,?)",
-                    (session_id, seq, file_path, int(time.time())))
-        self.conn.commit()
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("INSERT INTO reports(session_id, seq, file_path, created_at) VALUES(?,?,?,?)",
+                        (session_id, seq, file_path, int(time.time())))
+            self._commit()
 
-    def list_reports(self, order_no_like: Optional[str] = None) -> List[sqlite3.Row]:
-        cur = self.conn.cursor()
-        if order_no_like:
-            cur.execute("""
-              SELECT r.*, s.order_no FROM reports r
-              JOIN sessions s ON s.id=r.session_id
-              WHERE s.order_no LIKE ? ORDER BY r.id DESC
-            """, (f"%{order_no_like}%",))
-        else:
+    def list_reports(self, query: Optional[str] = None, limit: Optional[int] = None,
+                     after: Optional[Tuple] = None) -> List[sqlite3.Row]:
+        # query: words matched as prefixes against order no., operator, step notes and
+        # override master names (best match first); order no. substring without FTS5 or when
+        # the query has no word characters ("-", "/"), as FTS5 has no terms to match then.
+        # Keyset pagination: pass report_cursor(last row of the previous page) as `after`.
+        limit = -1 if limit is None else limit
+        with self.lock:
+            cur = self.conn.cursor()
+            match = fts_query(query) if self.has_fts else None
+            if match:
+                page = ""
+                args: Tuple = (match,)
+                if after:
+                    page = "AND (f.rank > ? OR (f.rank = ? AND (r.created_at, r.id) < (?, ?)))"
+                    args += (after[0], after[0], after[1], after[2])
+                cur.execute(f"""
+                  SELECT r.*, s.order_no, f.rank AS rank FROM history_fts f
+                  JOIN sessions s ON s.id=f.rowid
+                  JOIN reports r ON r.session_id=s.id
+                  WHERE history_fts MATCH ? {page}
+                  ORDER BY f.rank, r.created_at DESC, r.id DESC LIMIT ?
+                """, args + (limit,))
+            else:
+                where, args = [], ()
+                if query:
+                    where.append("s.order_no LIKE ?")
+                    args += (f"%{query}%",)
+                if after:
+                    where.append("(r.created_at, r.id) < (?, ?)")
+                    args += (after[0], after[1])
+                cur.execute(f"""
+                  SELECT r.*, s.order_no FROM reports r
+                  JOIN sessions s ON s.id=r.session_id
+                  {"WHERE " + " AND ".join(where) if where else ""}
+                  ORDER BY r.created_at DESC, r.id DESC LIMIT ?
+                """, args + (limit,))
+            return cur.fetchall()
+
+    @staticmethod
+    def report_cursor(row: sqlite3.Row) -> Tuple:
+        # position of a list_reports row, for the `after` argument of the next page
+        if "rank" in row.keys():
+            return (row["rank"], row["created_at"], row["id"])
+        return (row["created_at"], row["id"])
+
+    def get_session(self, session_id: int) -> Optional[sqlite3.Row]:
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("SELECT * FROM sessions WHERE id=?", (session_id,))
+            return cur.fetchone()
+
+    # ---------- Jobs ----------
+    def create_job(self, kind: str, params: Dict[str, Any]) -> int:
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("INSERT INTO jobs(kind, params, created_at) VALUES(?,?,?)",
+                        (kind, json.dumps(params, ensure_ascii=False), int(time.time())))
+            self._commit()
+            return cur.lastrowid
+
+    def get_job(self, job_id: int) -> Optional[sqlite3.Row]:
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("SELECT * FROM jobs WHERE id=?", (job_id,))
+            return cur.fetchone()
+
+    def set_job_status(self, job_id: int, status: str, error: Optional[str] = None,
+                       result: Optional[Any] = None, attempt: bool = False):
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("UPDATE jobs SET status=?, error=?, result=?, attempts=attempts+?, updated_at=? WHERE id=?",
+                        (status, error, json.dumps(result, ensure_ascii=False) if result is not None else None,
+                         1 if attempt else 0, int(time.time()), job_id))
+            self._commit()
+
+    def fail_interrupted_jobs(self) -> int:
+        # jobs left queued/running by a previous process can be retried from the UI
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("UPDATE jobs SET status='failed', error='interrupted', updated_at=? WHERE status IN ('queued','running')",
+                        (int(time.time()),))
+            self._commit()
+            return cur.rowcount
+
+    # ---------- Outbox ----------
+    def enqueue_mail(self, subject: str, body: str, attachments: List[str], log_action: str = "email_send") -> int:
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("INSERT INTO outbox(subject, body, attachments, log_action, created_at) VALUES(?,?,?,?,?)",
+                        (subject, body, json.dumps(attachments, ensure_ascii=False), log_action, int(time.time())))
+            self._commit()
+            return cur.lastrowid
+
+    def next_mail(self, now: int) -> Optional[sqlite3.Row]:
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("SELECT * FROM outbox WHERE status='queued' AND next_attempt_at<=? ORDER BY id LIMIT 1", (now,))
+            return cur.fetchone()
+
+    def next_mail_due(self) -> Optional[int]:
+        with self.lock:
+            return self.conn.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status='queued'").fetchone()[0]
+
+    def mark_mail_sent(self, mail_id: int):
+        with self.lock:
+            self.conn.execute("UPDATE outbox SET status='sent', attempts=attempts+1, last_error=NULL, sent_at=? WHERE id=?",
+                              (int(time.time()), mail_id))
+            self._commit()
+
+    def mark_mail_retry(self, mail_id: int, error: str, next_attempt_at: int):
+        with self.lock:
+            self.conn.execute("UPDATE outbox SET attempts=attempts+1, last_error=?, next_attempt_at=? WHERE id=?",
+                              (error, next_attempt_at, mail_id))
+            self._commit()
+
+    def mark_mail_failed(self, mail_id: int, error: str):
+        with self.lock:
+            self.conn.execute("UPDATE outbox SET status='failed', attempts=attempts+1, last_error=? WHERE id=?",
+                              (error, mail_id))
+            self._commit()
+
+    def requeue_mail(self, include_failed: bool = False) -> int:
+        # send now: clears the backoff and the attempt count of queued messages (and revives failed ones)
+        with self.lock:
+            cur = self.conn.cursor()
+            statuses = ("queued", "failed") if include_failed else ("queued",)
+            cur.execute(f"UPDATE outbox SET status='queued', attempts=0, next_attempt_at=0 WHERE status IN ({','.join('?' * len(statuses))})",
+                        statuses)
+            self._commit()
+            return cur.rowcount
+
+    def outbox_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            cur = self.conn.cursor()
+            counts = dict(cur.execute("SELECT status, COUNT(*) FROM outbox WHERE status IN ('queued','failed') GROUP BY status").fetchall())
+            last = cur.execute("SELECT last_error FROM outbox WHERE status IN ('queued','failed') AND last_error IS NOT NULL ORDER BY id DESC LIMIT 1").fetchone()
+            return {"queued": counts.get("queued", 0), "failed": counts.get("failed", 0),
+                    "last_error": last[0] if last else None}
+
+    def delete_sent_mail(self, before_ts: int) -> int:
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("DELETE FROM outbox WHERE status='sent' AND sent_at < ?", (before_ts,))
+            self._commit()
+            return cur.rowcount
+
+    # ---------- Digests ----------
+    def last_digest(self) -> Optional[sqlite3.Row]:
+        with self.lock:
+            return self.conn.execute("SELECT * FROM digests ORDER BY id DESC LIMIT 1").fetchone()
+
+    def reports_for_digest(self, since_ts: int) -> List[sqlite3.Row]:
+        # reports created since since_ts that are not part of a digest yet, with their session summary
+        with self.lock:
+            cur = self.conn.cursor()
             cur.execute("""
-              SELECT r.*, s.order_no FROM reports r
+              SELECT r.id, r.session_id, r.seq, r.file_path, r.created_at,
+                     s.order_no, s.operator_name, s.started_at, s.completed_at,
+                     (SELECT COUNT(*) FROM steps st WHERE st.session_id=s.id AND st.override_by_master=1) AS overrides
+              FROM reports r
               JOIN sessions s ON s.id=r.session_id
-              ORDER BY r.id DESC
-            """)
-        return cur.fetchall()
+              LEFT JOIN digest_reports dr ON dr.report_id=r.id
+              WHERE dr.report_id IS NULL AND r.created_at >= ?
+              ORDER BY r.created_at, r.id
+            """, (since_ts,))
+            return cur.fetchall()
+
+    def add_digest(self, period_start: int, period_end: int, report_ids: List[int], files: List[str]) -> int:
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("INSERT INTO digests(period_start, period_end, report_count, files, created_at) VALUES(?,?,?,?,?)",
+                        (period_start, period_end, len(report_ids), json.dumps(files, ensure_ascii=False), int(time.time())))
+            digest_id = cur.lastrowid
+            cur.executemany("INSERT INTO digest_reports(report_id, digest_id) VALUES(?,?)",
+                            [(rid, digest_id) for rid in report_ids])
+            self._commit()
+            return digest_id
+
+    # ---------- Retention ----------
+    def list_sessions_completed_before(self, ts: int, limit: int = 50) -> List[sqlite3.Row]:
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("SELECT * FROM sessions WHERE status='completed' AND completed_at < ? ORDER BY id LIMIT ?",
+                        (ts, limit))
+            return cur.fetchall()
+
+    def dump_session(self, session_id: int) -> Dict[str, Any]:
+        # everything stored for one session, as plain dicts (archive record)
+        with self.lock:
+            cur = self.conn.cursor()
+            sess = cur.execute("SELECT * FROM sessions WHERE id=?", (session_id,)).fetchone()
+            steps = cur.execute(STEP_SELECT + " WHERE st.session_id=? ORDER BY st.id", (session_id,)).fetchall()
+            versions = cur.execute("""
+              SELECT v.* FROM step_versions v JOIN steps st ON st.id=v.step_id
+              WHERE st.session_id=? ORDER BY v.id
+            """, (session_id,)).fetchall()
+            photos = cur.execute("""
+              SELECT p.* FROM photos p JOIN steps st ON st.id=p.step_id
+              WHERE st.session_id=? ORDER BY p.id
+            """, (session_id,)).fetchall()
+            reports = cur.execute("SELECT * FROM reports WHERE session_id=? ORDER BY id", (session_id,)).fetchall()
+            return {"session": dict(sess) if sess else None, "steps": [dict(r) for r in steps],
+                    "step_versions": [dict(r) for r in versions], "photos": [dict(r) for r in photos],
+                    "reports": [dict(r) for r in reports]}
+
+    def delete_sessions(self, session_ids: List[int]) -> int:
+        # steps, step_versions, photos and reports go with ON DELETE CASCADE
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.executemany("DELETE FROM sessions WHERE id=?", [(sid,) for sid in session_ids])
+            self._commit()
+            return len(session_ids)
+
+    def delete_logs(self, before_ts: int, max_id: int) -> int:
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("DELETE FROM logs WHERE ts < ? AND id <= ?", (before_ts, max_id))
+            self._commit()
+            return cur.rowcount
+
+    def delete_finished_jobs(self, before_ts: int) -> int:
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("DELETE FROM jobs WHERE status IN ('done','failed','cancelled') AND created_at < ?", (before_ts,))
+            self._commit()
+            return cur.rowcount
+
+    def file_bytes(self) -> int:
+        return sum(os.path.getsize(p) for p in (self.path, self.path + "-wal") if os.path.exists(p))
+
+    def reclaim_space(self, full: bool = False) -> int:
+        # Returns bytes returned to the file system; releases free pages only. A database created
+        # without auto_vacuum has to be converted by one full VACUUM first: that rewrites the whole
+        # file, so it is done only on request (full=True, a maintenance action) and on a connection
+        # of its own, not under self.lock - reads go on meanwhile, writes wait for it (busy timeout).
+        with self.lock:
+            if self._tx_depth:
+                raise RuntimeError("reclaim_space() inside a transaction")
+            self.conn.commit()
+            before = self.file_bytes()
+            converted = not self.needs_full_vacuum()
+            if converted:
+                self.conn.execute("PRAGMA incremental_vacuum").fetchall()
+        if full and not converted:
+            conn = sqlite3.connect(self.path, timeout=60)
+            try:
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM")
+            finally:
+                conn.close()
+        with self.lock:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+            return max(0, before - self.file_bytes())
+
+    def needs_full_vacuum(self) -> bool:
+        with self.lock:
+            # the pragma answers from the cached header until the schema is read again
+            self.conn.execute("SELECT count(*) FROM sqlite_master").fetchone()
+            return self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2
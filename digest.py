@@ -0,0 +1,97 @@
+
+import csv, io, os, time, zipfile
+from typing import Any, Callable, Dict, List, Optional
+
+# End-of-shift digest (email_mode = "digest"): instead of one message per session, the reports
+# finished since the previous digest go out together - zip archive(s) with the PDFs and
+# summary.csv (order, operator, duration, master overrides), the same table in the body.
+# Included reports are recorded in digest_reports, so a report is never sent twice.
+
+DEFAULT_INTERVAL_HOURS = 12
+SUMMARY_HEADER = ["Заказ", "Оператор", "Начато", "Окончено", "Длительность", "Обходов мастера", "Файл"]
+
+def _fmt_ts(ts: Optional[int]) -> str:
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(ts)) if ts else "-"
+
+def _fmt_duration(r) -> str:
+    if not (r["started_at"] and r["completed_at"]):
+        return "-"
+    minutes = max(0, r["completed_at"] - r["started_at"]) // 60
+    return f"{minutes // 60}:{minutes % 60:02d}"
+
+def summary_rows(reports) -> List[List[str]]:
+    return [[r["order_no"], r["operator_name"], _fmt_ts(r["started_at"]), _fmt_ts(r["completed_at"]),
+             _fmt_duration(r), str(r["overrides"]),
+             os.path.basename(r["file_path"]) if os.path.isfile(r["file_path"]) else "(файл отсутствует)"]
+            for r in reports]
+
+def summary_text(rows: List[List[str]]) -> str:
+    table = [SUMMARY_HEADER] + rows
+    widths = [max(len(row[i]) for row in table) for i in range(len(SUMMARY_HEADER))]
+    return "\n".join("  ".join(cell.ljust(w) for cell, w in zip(row, widths)).rstrip() for row in table)
+
+def _summary_csv(rows: List[List[str]]) -> bytes:
+    buf = io.StringIO()
+    w = csv.writer(buf, delimiter=";")
+    w.writerow(SUMMARY_HEADER)
+    w.writerows(rows)
+    return buf.getvalue().encode("utf-8-sig")  # BOM: Excel opens Cyrillic CSV correctly
+
+def _pack(files: List[str], max_bytes: int) -> List[List[str]]:
+    # greedy split by file size; a report bigger than the budget alone still gets its own archive
+    groups: List[List[str]] = [[]]
+    size = 0
+    for f in files:
+        fsize = os.path.getsize(f)
+        if groups[-1] and max_bytes and size + fsize > max_bytes:
+            groups.append([])
+            size = 0
+        groups[-1].append(f)
+        size += fsize
+    return groups
+
+def run_digest(db, out_dir: str, max_bytes: int = 0, interval_hours: Optional[int] = None,
+               now: Optional[int] = None, progress: Optional[Callable[[float, str], None]] = None) -> Dict[str, Any]:
+    # Queues the digest in the outbox (caller wakes the sender). Returns {"digest_id", "reports", "files"};
+    # digest_id is None when there was nothing to send.
+    progress = progress or (lambda fraction, text="": None)
+    now = int(time.time()) if now is None else now
+    if interval_hours is None:
+        interval_hours = int(db.get_setting("digest_interval_hours") or DEFAULT_INTERVAL_HOURS)
+    last = db.last_digest()
+    # first digest: one interval back, not the whole history
+    since = last["period_end"] if last else now - interval_hours * 3600
+    reports = db.reports_for_digest(since)
+    if not reports:
+        return {"digest_id": None, "reports": 0, "files": []}
+
+    rows = summary_rows(reports)
+    summary = _summary_csv(rows)
+    pdfs = list(dict.fromkeys(r["file_path"] for r in reports if os.path.isfile(r["file_path"])))
+    groups = _pack(pdfs, max(0, max_bytes - len(summary)))
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(now))
+    files = []
+    for k, group in enumerate(groups):
+        progress(k / len(groups), "Архив сводки")
+        suffix = f"_part{k + 1}of{len(groups)}" if len(groups) > 1 else ""
+        path = os.path.join(out_dir, f"digest_{stamp}{suffix}.zip")
+        with zipfile.ZipFile(path + ".tmp", "w") as z:
+            z.writestr("summary.csv", summary, compress_type=zipfile.ZIP_DEFLATED)
+            for f in group:
+                # PDFs are already compressed
+                z.write(f, os.path.basename(f), compress_type=zipfile.ZIP_STORED)
+        os.replace(path + ".tmp", path)
+        files.append(path)
+
+    period = f"{_fmt_ts(since)} – {_fmt_ts(now)}"
+    body = f"Сводка за период {period}, отчётов: {len(reports)}.\n\n{summary_text(rows)}\n"
+    with db.transaction():
+        digest_id = db.add_digest(since, now, [r["id"] for r in reports], files)
+        for k, path in enumerate(files):
+            part = f" ({k + 1}/{len(files)})" if len(files) > 1 else ""
+            db.enqueue_mail(f"CNC Checklist: сводка {period}{part}", body, [path], "email_digest")
+        db.log("INFO", "email_digest", {"digest_id": digest_id, "reports": len(reports),
+                                        "files": files, "bytes": [os.path.getsize(p) for p in files]})
+    progress(1.0, "Архив сводки")
+    return {"digest_id": digest_id, "reports": len(reports), "files": files}
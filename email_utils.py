@@ -1,18 +1,15 @@
 
 import smtplib, ssl, os, json, mimetypes
 from email.message import EmailMessage
-from typing import Dict, Any
+from typing import Dict, Any, List
 
-def send_email_with_attachment(settings: dict, subject: str, body: str, file_path: str) -> str:
-    host = settings.get("smtp_host")
-    port = int(settings.get("smtp_port") or 0)
-    user = settings.get("smtp_user")
-    password = settings.get("smtp_pass")
-    use_ssl = settings.get("smtp_ssl") == "1"
-    use_tls = settings.get("smtp_tls") == "1"
-    recipients = [r.strip() for r in (settings.get("recipients") or "").split(",") if r.strip()]
+def _recipients(settings: dict) -> List[str]:
+    return [r.strip() for r in (settings.get("recipients") or "").split(",") if r.strip()]
 
-    if not (host and port and user and password and recipients):
+def build_message(settings: dict, subject: str, body: str, attachments: List[str]) -> EmailMessage:
+    user = settings.get("smtp_user")
+    recipients = _recipients(settings)
+    if not (user and recipients):
         raise RuntimeError("SMTP settings incomplete")
 
     msg = EmailMessage()
@@ -21,28 +18,50 @@ def send_email_with_attachment(settings: dict, subject: str, body: str, file_pat
     msg["Subject"] = subject
     msg.set_content(body)
 
-    with open(file_path, "rb") as f:
-        data = f.read()
-    fname = os.path.basename(file_path)
-    
-    # Determine MIME type based on file extension
-    mime_type, _ = mimetypes.guess_type(file_path)
-    if mime_type:
-        maintype, subtype = mime_type.split('/', 1)
-    else:
-        # Default to PDF if type cannot be determined
-        maintype, subtype = "application", "pdf"
-    
-    msg.add_attachment(data, maintype=maintype, subtype=subtype, filename=fname)
+    for file_path in attachments:
+        with open(file_path, "rb") as f:
+            data = f.read()
+        fname = os.path.basename(file_path)
+
+        # Determine MIME type based on file extension
+        mime_type, _ = mimetypes.guess_type(file_path)
+        if mime_type:
+            maintype, subtype = mime_type.split('/', 1)
+        else:
+            # Default to PDF if type cannot be determined
+            maintype, subtype = "application", "pdf"
+
+        msg.add_attachment(data, maintype=maintype, subtype=subtype, filename=fname)
+    return msg
+
+def smtp_connect(settings: dict, timeout: float = 30.0) -> smtplib.SMTP:
+    # authenticated connection; the caller sends any number of messages and closes it (quit())
+    host = settings.get("smtp_host")
+    port = int(settings.get("smtp_port") or 0)
+    user = settings.get("smtp_user")
+    password = settings.get("smtp_pass")
+    use_ssl = settings.get("smtp_ssl") == "1"
+    use_tls = settings.get("smtp_tls") == "1"
+
+    if not (host and port and user and password and _recipients(settings)):
+        raise RuntimeError("SMTP settings incomplete")
 
     if use_ssl:
-        with smtplib.SMTP_SSL(host, port, context=ssl.create_default_context()) as s:
-            s.login(user, password)
-            s.send_message(msg)
+        s = smtplib.SMTP_SSL(host, port, timeout=timeout, context=ssl.create_default_context())
     else:
-        with smtplib.SMTP(host, port) as s:
-            if use_tls:
-                s.starttls(context=ssl.create_default_context())
-            s.login(user, password)
-            s.send_message(msg)
+        s = smtplib.SMTP(host, port, timeout=timeout)
+    try:
+        if use_tls and not use_ssl:
+            s.starttls(context=ssl.create_default_context())
+        s.login(user, password)
+    except Exception:
+        s.close()
+        raise
+    return s
+
+def send_email_with_attachment(settings: dict, subject: str, body: str, file_path: str) -> str:
+    # one-off send on its own connection; the app queues mail through outbox.MailSender
+    msg = build_message(settings, subject, body, [file_path])
+    with smtp_connect(settings) as s:
+        s.send_message(msg)
     return "OK"
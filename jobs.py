@@ -0,0 +1,144 @@
+
+import json, queue, threading
+from typing import Any, Callable, Dict, Optional
+
+# Background job executor: PDF generation and e-mail run on worker threads,
+# job state is persisted in the `jobs` table, callbacks are delivered via `dispatch`
+# (in the app: Clock.schedule_once, i.e. on the Kivy main loop).
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    def __init__(self, executor: "JobExecutor", job_id: int, kind: str, params: Dict[str, Any],
+                 callbacks: Dict[str, Callable], transient: Optional[Dict[str, Any]] = None):
+        self.executor = executor
+        self.id = job_id
+        self.kind = kind
+        self.params = params
+        self.transient = transient or {}
+        self.callbacks = callbacks
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def progress(self, fraction: float, text: str = ""):
+        # handlers call this between units of work; it is also the cancellation point
+        if self.cancelled:
+            raise JobCancelled()
+        self.executor._notify(self, "on_progress", max(0.0, min(1.0, fraction)), text)
+
+class JobExecutor:
+    def __init__(self, db, workers: int = 2, dispatch: Optional[Callable[[Callable], Any]] = None):
+        self.db = db
+        self.workers = max(1, workers)
+        self.dispatch = dispatch or (lambda fn: fn())
+        self._handlers: Dict[str, Callable] = {}
+        self._jobs: Dict[int, Job] = {}
+        self._queue: "queue.Queue[Optional[int]]" = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def register(self, kind: str, handler: Callable):
+        # handler(job, **params, **transient) -> JSON-serializable result
+        self._handlers[kind] = handler
+
+    def start(self):
+        if self._threads:
+            return
+        self.db.fail_interrupted_jobs()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        self._threads = []
+
+    def submit(self, kind: str, params: Optional[Dict[str, Any]] = None, on_progress=None,
+               on_done=None, on_error=None, on_cancel=None, transient: Optional[Dict[str, Any]] = None) -> int:
+        # params are persisted with the job; transient kwargs (e.g. bulky in-memory snapshots) are
+        # only handed to the handler in this process - it must cope without them after a restart
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        params = params or {}
+        job_id = self.db.create_job(kind, params)
+        self._enqueue(job_id, kind, params, transient, on_progress=on_progress, on_done=on_done,
+                      on_error=on_error, on_cancel=on_cancel)
+        return job_id
+
+    def cancel(self, job_id: int) -> bool:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if not job:
+            return False
+        job._cancel.set()
+        return True
+
+    def retry(self, job_id: int, on_progress=None, on_done=None, on_error=None, on_cancel=None,
+              transient: Optional[Dict[str, Any]] = None) -> bool:
+        row = self.db.get_job(job_id)
+        if not row or row["status"] not in ("failed", "cancelled") or row["kind"] not in self._handlers:
+            return False
+        with self._lock:
+            if job_id in self._jobs:
+                return False
+        self.db.set_job_status(job_id, "queued")
+        self._enqueue(job_id, row["kind"], json.loads(row["params"] or "{}"), transient, on_progress=on_progress,
+                      on_done=on_done, on_error=on_error, on_cancel=on_cancel)
+        return True
+
+    def is_active(self, job_id: int) -> bool:
+        with self._lock:
+            return job_id in self._jobs
+
+    def _enqueue(self, job_id: int, kind: str, params: Dict[str, Any], transient: Optional[Dict[str, Any]],
+                 **callbacks):
+        job = Job(self, job_id, kind, params, {k: v for k, v in callbacks.items() if v}, transient)
+        with self._lock:
+            self._jobs[job_id] = job
+        self._queue.put(job_id)
+
+    def _notify(self, job: Job, name: str, *args):
+        cb = job.callbacks.get(name)
+        if cb:
+            self.dispatch(lambda: cb(*args))
+
+    def _run(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+            with self._lock:
+                job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            try:
+                self._execute(job)
+            finally:
+                with self._lock:
+                    self._jobs.pop(job_id, None)
+
+    def _execute(self, job: Job):
+        if job.cancelled:
+            self.db.set_job_status(job.id, "cancelled")
+            self._notify(job, "on_cancel")
+            return
+        self.db.set_job_status(job.id, "running", attempt=True)
+        try:
+            result = self._handlers[job.kind](job, **job.params, **job.transient)
+        except JobCancelled:
+            self.db.set_job_status(job.id, "cancelled")
+            self.db.log("INFO", "job_cancel", {"job_id": job.id, "kind": job.kind})
+            self._notify(job, "on_cancel")
+        except Exception as e:
+            self.db.set_job_status(job.id, "failed", error=str(e))
+            self.db.log("ERROR", "job_failed", {"job_id": job.id, "kind": job.kind, "error": str(e)})
+            self._notify(job, "on_error", str(e))
+        else:
+            self.db.set_job_status(job.id, "done", result=result)
+            self._notify(job, "on_done", result)
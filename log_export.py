@@ -0,0 +1,37 @@
+
+import csv, gzip, os
+from typing import Callable, Iterable, Optional
+
+# Streaming audit-log export: rows are read in batches and written straight to the file,
+# memory use does not depend on the size of the log.
+
+def export_logs(db, path: str, since: Optional[int] = None, until: Optional[int] = None,
+                levels: Optional[Iterable[str]] = None, actions: Optional[Iterable[str]] = None,
+                compress: bool = False, batch_size: int = 500,
+                progress: Optional[Callable[[float, str], None]] = None) -> int:
+    # since/until: unix ts range [since, until); compress: gzip output (path should end with .gz).
+    # Returns the number of exported rows.
+    progress = progress or (lambda fraction, text="": None)
+    levels = list(levels) if levels else None
+    actions = list(actions) if actions else None
+    db.flush_logs()
+    total = db.count_logs(since, until, levels, actions)
+    tmp = path + ".tmp"
+    n = 0
+    try:
+        f = gzip.open(tmp, "wt", encoding="utf-8", newline="") if compress else open(tmp, "w", encoding="utf-8", newline="")
+        with f:
+            w = csv.writer(f, delimiter=";")
+            w.writerow(["ts","level","action","details_json"])
+            for r in db.iter_logs(since, until, levels, actions, batch_size=batch_size):
+                w.writerow([r["ts"], r["level"], r["action"], r["details"]])
+                n += 1
+                if n % batch_size == 0:
+                    progress(n / max(1, total), "Экспорт журнала")
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    progress(1.0, "Экспорт журнала")
+    return n
@@ -1,11 +1,10 @@
 
-import os, json, time, sys
+import os, time, sys, threading
 from functools import partial
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from kivy.clock import Clock
 from kivy.lang import Builder
 from kivy.metrics import dp
-from kivy.core.window import Window
 
 from kivymd.app import MDApp
 from kivymd.uix.list import OneLineListItem, ThreeLineListItem
@@ -13,12 +12,23 @@ from kivymd.uix.dialog import MDDialog
 from kivymd.uix.button import MDRaisedButton, MDFlatButton
 from kivymd.uix.boxlayout import MDBoxLayout
 from kivymd.uix.snackbar import Snackbar
+from kivymd.uix.label import MDLabel
+from kivymd.uix.progressbar import MDProgressBar
 from kivy.properties import StringProperty, BooleanProperty, NumericProperty
 
 from db import DB
-from security import init_default_pins, verify_pin, pbkdf2_hash
-from pdf_report import generate_pdf
-from email_utils import send_email_with_attachment
+from security import init_default_pins, check_pin, pin_settings, target_kdf
+from jobs import JobCancelled, JobExecutor
+from outbox import MailSender
+from photo_cache import PhotoCache
+from session_state import SessionState
+from log_export import export_logs
+from retention import run_retention
+from digest import DEFAULT_INTERVAL_HOURS, run_digest
+from checklist_loader import CompiledChecklist, load_checklist
+# pdf_report (reportlab, PIL), photo_ingest (PIL) and email_utils (smtplib) are imported in the
+# job handlers: they are only needed at session finish, keep them out of cold start
+# (measured by tools/bench_startup.py).
 
 # Android-specific imports guarded
 try:
@@ -36,20 +46,84 @@ except Exception:
 
 APP_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(APP_DIR, "app.db")
-
-# Load KV
-Builder.load_file(os.path.join("kv", "ui.kv"))
+SMTP_KEYS = ("smtp_host", "smtp_port", "smtp_user", "smtp_pass", "smtp_ssl", "smtp_tls", "recipients")
+
+# Row heights of the recycled lists (RecycleBoxLayout sizes rows from data, not from the views)
+HEADER_ROW_HEIGHT = dp(48)
+STEP_ROW_HEIGHT = dp(150)
+FINISH_ROW_HEIGHT = dp(64)
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_FILTER_DELAY = 0.35  # s, filter input debounce
+EMAIL_MAX_MB = 7  # default of setting email_max_mb: attachment budget (base64 adds ~1/3 on the wire); 0 = no limit
+ADMIN_GRANT_TTL = 300  # s, default of setting admin_grant_ttl; 0 = ask the admin PIN every time
+
+# Virtualized lists: only visible rows exist as widgets. They replace the ScrollView around
+# `steps_container` / `history_list` from kv/ui.kv at build time (see _mount_recycle_view).
+Builder.load_string("""
+# StepItem itself is in kv/ui.kv; its note field shows root.step_note, so a recycled view
+# takes the note of the step it is bound to, not the text typed into its previous one.
+<StepItem>:
+    step_note: ""
+
+<ChecklistBlockHeader@OneLineListItem>:
+    markup: True
+    theme_text_color: "Primary"
+
+<ChecklistFinishButton@MDRaisedButton>:
+    text: "Завершить и сформировать отчёт"
+    on_release: app.finish_session()
+
+<HistoryRow@ThreeLineListItem>:
+    file_path: ""
+    on_release: app.open_pdf(self.file_path)
+
+<ChecklistRecycleView@RecycleView>:
+    RecycleBoxLayout:
+        orientation: "vertical"
+        key_viewclass: "viewclass"
+        key_size: "row_size"
+        default_size: None, dp(72)
+        default_size_hint: 1, None
+        size_hint_y: None
+        height: self.minimum_height
+        spacing: dp(6)
+        padding: dp(8)
+
+<HistoryRecycleView@RecycleView>:
+    viewclass: "HistoryRow"
+    RecycleBoxLayout:
+        orientation: "vertical"
+        default_size: None, dp(88)
+        default_size_hint: 1, None
+        size_hint_y: None
+        height: self.minimum_height
+""")
 
 class CNCChecklistApp(MDApp):
-    checklist: Dict[str, Any] = {}
+    checklist: CompiledChecklist
     db: DB
     session_id: Optional[int] = None
+    state: Optional[SessionState] = None
     save_dir: str = ""
     autosave_ev = None
+    jobs: JobExecutor
+    mailer: MailSender
+    step_rows: Dict[int, int] = {}  # step_id -> index in steps_rv.data
+    steps_rv = None
+    history_rv = None
+    history_query = ""
+    history_cursor = None  # keyset position of the last loaded row, None when exhausted
+    history_ev = None
+    photo_cache: PhotoCache
+    digest_job: Optional[int] = None
+    pending_report: Optional[Tuple[int, int]] = None  # (session_id, seq) reserved by finish_session
+    admin_grant_until = 0.0  # time.monotonic() until which a verified admin PIN is honoured
 
     def build(self):
         self.title = "CNC Checklist"
         self.theme_cls.primary_palette = "Indigo"
+        # journal_mode / synchronous come from settings db_journal_mode / db_synchronous
         self.db = DB(DB_PATH)
         init_default_pins(self.db)
         # save dir default
@@ -59,15 +133,60 @@ class CNCChecklistApp(MDApp):
             self.db.set_setting("save_dir", default_dir)
         self.save_dir = self.db.get_setting("save_dir")
 
-        with open(os.path.join(APP_DIR, "checklist.json"), "r", encoding="utf-8") as f:
-            self.checklist = json.load(f)
+        cache_mb = int(self.db.get_setting("photo_cache_mb") or "200")
+        self.photo_cache = PhotoCache(os.path.join(APP_DIR, "cache", "photos"), max_bytes=cache_mb * 1024 * 1024)
+
+        # PDFs etc. run on worker threads, mail goes through the outbox; callbacks come back on the Kivy loop
+        dispatch = lambda fn: Clock.schedule_once(lambda dt: fn())
+        self.jobs = JobExecutor(self.db, workers=2, dispatch=dispatch)
+        self.jobs.register("report", self._job_report)
+        self.jobs.register("report_mail", self._job_report_mail)
+        self.jobs.register("photo_ingest", self._job_photo_ingest)
+        self.jobs.register("log_export", self._job_log_export)
+        self.jobs.register("retention", self._job_retention)
+        self.jobs.register("db_compact", self._job_db_compact)
+        self.jobs.register("digest", self._job_digest)
+        self.jobs.start()
+        # photos added right before the previous shutdown
+        for ph in self.db.get_photos_pending_ingest():
+            self.jobs.submit("photo_ingest", {"photo_id": ph["id"]})
+        # archive aged logs/sessions at most once a day
+        if int(time.time()) - int(self.db.get_setting("retention_last_run") or "0") > 24 * 3600:
+            self.jobs.submit("retention")
+        self.mailer = MailSender(self.db, settings=lambda: self.db.get_settings(SMTP_KEYS), dispatch=dispatch,
+                                 on_sent=lambda subject: self.toast(f"Письмо отправлено: {subject}"),
+                                 on_error=self._on_mail_error)
+        self.mailer.start()
+
+        self.checklist = load_checklist(os.path.join(APP_DIR, "checklist.json"),
+                                        os.path.join(APP_DIR, "cache", "checklist.pickle"))
 
         self.root = Builder.load_file(os.path.join("kv", "ui.kv"))
+        from kivy.factory import Factory
+        self.steps_rv = self._mount_recycle_view(self.root.get_screen("checklist").ids.steps_container,
+                                                 Factory.ChecklistRecycleView())
+        self.history_rv = self._mount_recycle_view(self.root.get_screen("history").ids.history_list,
+                                                   Factory.HistoryRecycleView())
+        self.history_rv.bind(scroll_y=self._on_history_scroll)
+        self.root.get_screen("settings").bind(on_leave=lambda *_: self.revoke_admin_grant("leave_settings"))
         self.update_resume_label()
         # autosave tick
         self.autosave_ev = Clock.schedule_interval(self.autosave, 10.0)
+        # end-of-shift digest (email_mode=digest)
+        Clock.schedule_interval(self._digest_tick, 300.0)
         return self.root
 
+    def on_pause(self):
+        # the OS may kill a paused app: persist buffered log rows now
+        self.revoke_admin_grant("pause")
+        self.db.flush_logs()
+        return True
+
+    def on_stop(self):
+        self.jobs.stop()
+        self.mailer.stop()
+        self.db.stop_log_writer()
+
     # ---------- Navigation ----------
     def go_screen(self, name: str):
         self.root.current = name
@@ -78,14 +197,14 @@ class CNCChecklistApp(MDApp):
 
     def open_settings_screen(self):
         # admin PIN gate
-        self.ask_pin(role="admin", on_ok=self._open_settings_after_pin)
+        self.ask_pin(role="admin", on_ok=self._open_settings_after_pin, purpose="settings")
 
     def _open_settings_after_pin(self, ok: bool):
         if ok:
             self.go_screen("settings")
 
     def open_history_screen(self):
-        self.refresh_history("")
+        self._reload_history("")
         self.go_screen("history")
 
     # ---------- Start / Resume ----------
@@ -110,56 +229,77 @@ class CNCChecklistApp(MDApp):
 
     def _resume(self, sess_row):
         self.session_id = sess_row["id"]
+        self.state = SessionState(self.db, self.session_id)
         self.load_checklist_ui()
         self.go_screen("checklist")
 
     def _new_session(self, order_no: str, operator_name: str):
-        self.session_id = self.db.create_session(order_no, operator_name)
-        self.db.ensure_steps_for_session(self.session_id, self.checklist)
-        self.db.log("INFO", "session_create", {"session_id": self.session_id, "order_no": order_no})
+        with self.db.transaction():
+            self.session_id = self.db.create_session(order_no, operator_name)
+            self.db.ensure_steps_for_session(self.session_id, self.checklist)
+            self.db.log("INFO", "session_create", {"session_id": self.session_id, "order_no": order_no})
+        self.state = SessionState(self.db, self.session_id)
         self.load_checklist_ui()
         self.go_screen("checklist")
 
     # ---------- Checklist UI ----------
-    def load_checklist_ui(self):
-        scr = self.root.get_screen("checklist")
-        container = scr.ids.steps_container
-        container.clear_widgets()
+    def _mount_recycle_view(self, placeholder, rv):
+        # kv/ui.kv wraps the list container in a ScrollView; RecycleView scrolls itself, so it takes that slot
+        from kivy.uix.scrollview import ScrollView
+        slot = placeholder.parent if isinstance(placeholder.parent, ScrollView) else placeholder
+        host = slot.parent
+        index = host.children.index(slot)
+        host.remove_widget(slot)
+        host.add_widget(rv, index=index)
+        return rv
 
-        steps = self.db.get_steps(self.session_id)
-        # progress
-        done = sum(1 for s in steps if s["status"] == "done")
-        total = len(steps)
-        scr.ids.progress.value = 100.0 * done / max(1, total)
+    def load_checklist_ui(self):
+        # full rebuild of the row data: only when a session is opened, status changes go through refresh_step()
+        steps = self.state.steps
+        data = []
+        self.step_rows = {}
 
         # group by block
         current_block = -1
         for st in steps:
             if st["block_index"] != current_block:
                 current_block = st["block_index"]
-                header = OneLineListItem(text=f"[b]{self.checklist['blocks'][current_block]['title']}[/b]")
-                header.theme_text_color = "Primary"
-                header.markup = True
-                container.add_widget(header)
-
-            item = self._make_step_card(st)
-            container.add_widget(item)
+                data.append({"viewclass": "ChecklistBlockHeader", "row_size": (None, HEADER_ROW_HEIGHT),
+                             "text": f"[b]{self.checklist.block_titles[current_block]}[/b]"})
+            self.step_rows[st["id"]] = len(data)
+            data.append(self._make_step_row(st))
 
         # Add finish button
-        container.add_widget(
-            MDRaisedButton(text="Завершить и сформировать отчёт", on_release=lambda *_: self.finish_session())
-        )
+        data.append({"viewclass": "ChecklistFinishButton", "row_size": (None, FINISH_ROW_HEIGHT)})
+        self.steps_rv.data = data
+        self.update_progress()
+
+    def refresh_step(self, step_id: int):
+        idx = self.step_rows.get(step_id)
+        st = self.state.get(step_id)
+        if idx is None or st is None:
+            self.load_checklist_ui()
+            return
+        self.steps_rv.data[idx]["step_status"] = st.status
+        # re-applies data to the visible views only
+        self.steps_rv.refresh_from_data()
+        self.update_progress()
 
-    def _make_step_card(self, st_row):
-        from kivymd.uix.card import MDCard
-        from kivy.factory import Factory
-        card = Factory.StepItem()
-        card.step_id = st_row["id"]
-        card.step_text = st_row["text"]
-        card.step_hint = st_row["hint"] or ""
-        card.step_status = st_row["status"]
-        card.critical = bool(st_row["critical"])
-        return card
+    def update_progress(self):
+        scr = self.root.get_screen("checklist")
+        scr.ids.progress.value = 100.0 * self.state.progress()
+
+    def _make_step_row(self, st_row) -> Dict[str, Any]:
+        return {
+            "viewclass": "StepItem",
+            "row_size": (None, STEP_ROW_HEIGHT),
+            "step_id": st_row["id"],
+            "step_text": st_row["text"],
+            "step_hint": st_row["hint"] or "",
+            "step_status": st_row["status"],
+            "step_note": st_row["note"] or "",
+            "critical": bool(st_row["critical"]),
+        }
 
     def get_step_color(self, status: str):
         # pending=grey, in_progress=yellow, done=green, failed=red
@@ -178,15 +318,15 @@ class CNCChecklistApp(MDApp):
 
     def update_step_status(self, step_id: int, new_status: str):
         # If failing critical -> require master PIN
-        st = next((s for s in self.db.get_steps(self.session_id) if s["id"] == step_id), None)
+        st = self.state.get(step_id)
         if not st:
             return
-        if new_status == "failed" and st["critical"]:
+        if new_status == "failed" and st.critical:
             # require PIN and master name
             self.ask_pin(role="master", on_ok=lambda ok, name=None: self._after_master_for_fail(ok, step_id, name))
             return
-        self.db.update_step_status(step_id, new_status)
-        self.load_checklist_ui()
+        self.state.set_status(step_id, new_status)
+        self.refresh_step(step_id)
 
     def handle_fail_step(self, step_id: int):
         # route to update_step_status("failed") with master gate if needed
@@ -195,19 +335,24 @@ class CNCChecklistApp(MDApp):
     def _after_master_for_fail(self, ok: bool, step_id: int, master_name: Optional[str]):
         if not ok:
             return
-        # mark failed + override flag
-        self.db.update_step_status(step_id, "failed")
-        if master_name:
-            self.db.set_step_master_override(step_id, master_name)
-        self.db.log("AUDIT", "critical_override", {"step_id": step_id, "master_name": master_name})
-        self.load_checklist_ui()
+        # mark failed + override flag, one commit
+        with self.db.transaction():
+            self.state.set_status(step_id, "failed")
+            if master_name:
+                self.state.set_master_override(step_id, master_name)
+            self.db.log("AUDIT", "critical_override", {"step_id": step_id, "master_name": master_name})
+        self.refresh_step(step_id)
 
     def update_step_note(self, step_id: int, note: str):
         # simple status keep but update note
-        st = next((s for s in self.db.get_steps(self.session_id) if s["id"] == step_id), None)
+        st = self.state.get(step_id)
         if not st:
             return
-        self.db.update_step_status(step_id, st["status"], note=note)
+        self.state.set_status(step_id, st.status, note=note)
+        # row data is what a recycled view is refilled from; the visible field already shows the text
+        idx = self.step_rows.get(step_id)
+        if idx is not None:
+            self.steps_rv.data[idx]["step_note"] = note
 
     def take_photo_for_step(self, step_id: int):
         ts = int(time.time())
@@ -220,7 +365,7 @@ class CNCChecklistApp(MDApp):
             if not path:
                 self.toast("Фото отменено")
                 return
-            self.db.add_photo(step_id, path)
+            self._add_photo(step_id, path)
             self.toast("Фото добавлено")
         try:
             if camera:
@@ -230,7 +375,7 @@ class CNCChecklistApp(MDApp):
                 if filechooser:
                     paths = filechooser.open_file(filters=[("Images", "*.png;*.jpg;*.jpeg")])
                     if paths:
-                        self.db.add_photo(step_id, paths[0])
+                        self._add_photo(step_id, paths[0])
                         self.toast("Фото добавлено (из файла)")
                 else:
                     self.toast("Камера недоступна")
@@ -238,6 +383,26 @@ class CNCChecklistApp(MDApp):
             self.toast(f"Ошибка камеры: {e}")
             self.db.log("ERROR", "camera_error", {"error": str(e), "step_id": step_id})
 
+    def _add_photo(self, step_id: int, path: str):
+        photo_id = self.db.add_photo(step_id, path)
+        # orientation/resize/thumbnail/hash in background, report then only embeds the derivative
+        self.jobs.submit("photo_ingest", {"photo_id": photo_id})
+
+    def _job_photo_ingest(self, job, photo_id: int):
+        ph = self.db.get_photo(photo_id)
+        if not ph:
+            return None
+        from photo_ingest import ingest_photo
+        try:
+            meta = ingest_photo(ph["file_path"], os.path.join(APP_DIR, "photos", "derived"), photo_id)
+        except Exception as e:
+            # counted: after INGEST_MAX_ATTEMPTS start-ups stop re-queuing it, the report uses the original
+            self.db.set_photo_ingest_failed(photo_id, str(e) or e.__class__.__name__)
+            self.db.log("ERROR", "photo_ingest", {"photo_id": photo_id, "error": str(e)})
+            raise
+        self.db.set_photo_derivatives(photo_id, **meta)
+        return meta
+
     # ---------- Finish / PDF / Email ----------
     def finish_session(self):
         # Validate: no blocking critical failures without override? Here spec allows override with master PIN already.
@@ -245,64 +410,222 @@ class CNCChecklistApp(MDApp):
         if not sess or sess["id"] != self.session_id:
             self.toast("Нет активной сессии")
             return
-        # mark completed
-        self.db.mark_session_completed(self.session_id)
-        # gather data
-        steps = self.db.get_steps(self.session_id)
+        # the session stays active until its report is stored (the job completes it), so a cancelled
+        # or failed report leaves it resumable; finishing it again reuses the reserved number
+        if self.pending_report and self.pending_report[0] == self.session_id:
+            seq = self.pending_report[1]
+        else:
+            seq = self.db.bump_report_seq()
+            self.pending_report = (self.session_id, seq)
+        save_dir = self.db.get_setting("save_dir") or self.save_dir or APP_DIR
+        # report is rendered in background; the dialog tracks progress and allows cancel/retry
+        self._run_report_job({"session_id": self.session_id, "seq": seq, "save_dir": save_dir,
+                              "checklist_version": self.checklist.version, "completed_at": int(time.time())},
+                             on_done=self._after_finish_report, steps=self.state.snapshot())
+
+    def _after_finish_report(self, result):
+        self.pending_report = None
+        pdf_path = result["file"]
+        # email (if enabled)
+        if (self.db.get_setting("email_enabled") or "0") == "1" and self.db.get_setting("email_mode") != "digest":
+            # size budget check (and re-render if needed) happens in the job, mail is queued from there
+            self.jobs.submit("report_mail", {"file_path": pdf_path, "session_id": result["session_id"],
+                                             "seq": result["seq"], "checklist_version": result["checklist_version"]},
+                             on_error=lambda err: self.toast(f"Ошибка подготовки письма: {err}"))
+        # done message
+        self.confirm(self.checklist.finish_message,
+                     yes_text="OK", no_text="", on_yes=lambda *_: self.back_to_start())
+
+    def _run_report_job(self, params: Dict[str, Any], on_done, job_id: Optional[int] = None,
+                        steps: Optional[List[Dict[str, Any]]] = None):
+        # steps: SessionState.snapshot() taken on the UI thread, handed to the job in memory only
+        # (not stored in jobs.params; without it the job reads the steps from the DB)
+        label = MDLabel(text="Подготовка…", adaptive_height=True)
+        bar = MDProgressBar(value=0)
+        layout = MDBoxLayout(orientation="vertical", spacing=dp(8), adaptive_height=True)
+        layout.add_widget(label)
+        layout.add_widget(bar)
+        dlg = MDDialog(title="Формирование отчёта", type="custom", content_cls=layout, auto_dismiss=False,
+                       buttons=[MDFlatButton(text="Отмена", on_release=lambda *_: self.jobs.cancel(state["job_id"]))])
+        state = {"job_id": job_id}
+
+        def on_progress(fraction, text):
+            bar.value = 100.0 * fraction
+            if text:
+                label.text = text
+
+        def on_error(err):
+            dlg.dismiss()
+            self.toast(f"Ошибка генерации PDF: {err}")
+            self.confirm(f"Отчёт не сформирован: {err}", yes_text="Повторить", no_text="Закрыть",
+                         on_yes=lambda *_: self._run_report_job(params, on_done, job_id=state["job_id"], steps=steps))
+
+        def on_cancel():
+            dlg.dismiss()
+            self.confirm("Формирование отчёта отменено", yes_text="Повторить", no_text="Закрыть",
+                         on_yes=lambda *_: self._run_report_job(params, on_done, job_id=state["job_id"], steps=steps))
+
+        def done(result):
+            dlg.dismiss()
+            on_done(result)
+
+        callbacks = dict(on_progress=on_progress, on_done=done, on_error=on_error, on_cancel=on_cancel,
+                         transient={"steps": steps} if steps is not None else None)
+        if job_id is None or not self.jobs.retry(job_id, **callbacks):
+            state["job_id"] = self.jobs.submit("report", params, **callbacks)
+        dlg.open()
+
+    def _photos_by_step(self, steps) -> Dict[int, List[str]]:
         photos_by_step = {}
         for st in steps:
-            phs = [r["file_path"] for r in self.db.get_photos_for_step(st["id"])]
+            phs = [r["norm_path"] if r["norm_path"] and os.path.exists(r["norm_path"]) else r["file_path"]
+                   for r in self.db.get_photos_for_step(st["id"])]
             if phs:
                 photos_by_step[st["id"]] = phs
-        seq = self.db.bump_report_seq()
-        save_dir = self.db.get_setting("save_dir") or self.save_dir or APP_DIR
-
-        # ensure dir exists
+        return photos_by_step
+
+    def _report_inputs(self, session_id: int, steps: Optional[List[Dict[str, Any]]] = None):
+        # worker thread: steps is the snapshot taken on the UI thread, otherwise they are read from the DB
+        sess = self.db.get_session(session_id)
+        if steps is None:
+            steps = SessionState(self.db, session_id).steps
+        return sess, steps, self._photos_by_step(steps)
+
+    def _photo_workers(self) -> Optional[int]:
+        # photo_workers: 0 = auto (cores/memory), 1 = serial
+        return int(self.db.get_setting("photo_workers") or "0") or None
+
+    def _job_report(self, job, session_id: int, seq: int, save_dir: str, checklist_version: str,
+                    completed_at: Optional[int] = None, steps: Optional[List[Dict[str, Any]]] = None):
+        # runs on a worker thread: no widget or self.state access here (steps: in-memory snapshot, transient).
+        # completed_at: finishing report - the session is marked completed together with the report row
+        sess, steps, photos_by_step = self._report_inputs(session_id, steps)
+        if completed_at is not None:
+            sess = dict(sess, status="completed", completed_at=completed_at)
         os.makedirs(save_dir, exist_ok=True)
-
+        workers = self._photo_workers()
+        before = self.photo_cache.stats()
+        from pdf_report import generate_pdf
         try:
-            pdf_path = generate_pdf(self.db, sess, steps, photos_by_step, save_dir, seq, self.checklist.get("version", "1.0"))
-            self.db.add_report(self.session_id, seq, pdf_path)
-            self.db.log("INFO", "pdf_generate", {"file": pdf_path})
+            pdf_path = generate_pdf(self.db, sess, steps, photos_by_step, save_dir, seq, checklist_version,
+                                    progress=job.progress, photo_cache=self.photo_cache, photo_workers=workers)
+        except JobCancelled:
+            raise
         except Exception as e:
-            self.toast(f"Ошибка генерации PDF: {e}")
-            self.db.log("ERROR", "pdf_generate", {"error": str(e), "session_id": self.session_id})
+            self.db.log("ERROR", "pdf_generate", {"error": str(e), "session_id": session_id})
+            raise
+        after = self.photo_cache.stats()
+        with self.db.transaction():
+            if completed_at is not None:
+                self.db.mark_session_completed(session_id, completed_at)
+            self.db.add_report(session_id, seq, pdf_path)
+            self.db.log("INFO", "pdf_generate", {"file": pdf_path,
+                                                 "photo_cache_hits": after["hits"] - before["hits"],
+                                                 "photo_cache_misses": after["misses"] - before["misses"]})
+        return {"file": pdf_path, "session_id": session_id, "seq": seq, "checklist_version": checklist_version}
+
+    def _job_report_mail(self, job, file_path: str, session_id: int, seq: int, checklist_version: str):
+        # the archived report stays as rendered; an attachment over email_max_mb is re-rendered with
+        # smaller photos into outgoing/ or split into parts, one message per part
+        from pdf_report import PHOTO_PROFILES
+        max_bytes = int(float(self.db.get_setting("email_max_mb") or EMAIL_MAX_MB) * 1024 * 1024)
+        size = os.path.getsize(file_path)
+        files, profile = [file_path], PHOTO_PROFILES[0]
+        if max_bytes and size > max_bytes:
+            from pdf_report import generate_pdf, fit_report
+            sess, steps, photos_by_step = self._report_inputs(session_id)
+            out_dir = os.path.join(APP_DIR, "outgoing")
+            os.makedirs(out_dir, exist_ok=True)
+            workers = self._photo_workers()
+            render = lambda photo_profile, photos, part: generate_pdf(
+                self.db, sess, steps, photos, out_dir, seq, checklist_version, photo_cache=self.photo_cache,
+                photo_workers=workers, photo_profile=photo_profile, part=part)
+            files, profile = fit_report(render, photos_by_step, max_bytes, size, progress=job.progress)
+        sizes = [os.path.getsize(f) for f in files]
+        with self.db.transaction():
+            for i, f in enumerate(files):
+                subject = "CNC Checklist Report" + (f" ({i + 1}/{len(files)})" if len(files) > 1 else "")
+                self.db.enqueue_mail(subject, "См. вложение", [f], "email_send")
+            self.db.log("INFO", "email_attachment", {"session_id": session_id, "budget": max_bytes,
+                                                     "original_bytes": size, "max_dim": profile[0],
+                                                     "quality": profile[1], "parts": len(files), "bytes": sizes})
+        self.mailer.wake()
+        return {"files": files, "bytes": sizes}
+
+    def _digest_tick(self, dt=None):
+        settings = self.db.get_settings(("email_enabled", "email_mode", "digest_interval_hours", "digest_last_run"))
+        if settings["email_enabled"] != "1" or settings["email_mode"] != "digest":
+            return
+        now = int(time.time())
+        if not settings["digest_last_run"]:
+            # digest mode just switched on: the first shift starts now
+            self.db.set_setting("digest_last_run", str(now))
             return
+        interval = int(settings["digest_interval_hours"] or DEFAULT_INTERVAL_HOURS) * 3600
+        if now - int(settings["digest_last_run"]) >= interval and not (self.digest_job and self.jobs.is_active(self.digest_job)):
+            self.digest_job = self.jobs.submit("digest")
 
-        # email (if enabled)
-        if (self.db.get_setting("email_enabled") or "0") == "1":
-            try:
-                settings = {
-                    "smtp_host": self.db.get_setting("smtp_host"),
-                    "smtp_port": self.db.get_setting("smtp_port"),
-                    "smtp_user": self.db.get_setting("smtp_user"),
-                    "smtp_pass": self.db.get_setting("smtp_pass"),
-                    "smtp_ssl": self.db.get_setting("smtp_ssl"),
-                    "smtp_tls": self.db.get_setting("smtp_tls"),
-                    "recipients": self.db.get_setting("recipients"),
-                }
-                send_email_with_attachment(settings, "CNC Checklist Report", "См. вложение", pdf_path)
-                self.db.log("INFO", "email_send", {"ok": True, "file": pdf_path})
-                self.toast("Отчёт отправлен по e-mail")
-            except Exception as e:
-                self.db.log("ERROR", "email_send", {"ok": False, "error": str(e)})
-                self.toast(f"Ошибка e-mail: {e}")
+    def send_digest_now(self):
+        if self.digest_job and self.jobs.is_active(self.digest_job):
+            self.toast("Сводка уже формируется")
+            return
+        self.digest_job = self.jobs.submit(
+            "digest", on_error=lambda err: self.toast(f"Ошибка сводки: {err}"),
+            on_done=lambda res: self.toast(f"Сводка в очереди: отчётов {res['reports']}" if res["reports"]
+                                           else "Нет новых отчётов для сводки"))
+
+    def _job_digest(self, job):
+        max_bytes = int(float(self.db.get_setting("email_max_mb") or EMAIL_MAX_MB) * 1024 * 1024)
+        result = run_digest(self.db, os.path.join(APP_DIR, "outgoing"), max_bytes, progress=job.progress)
+        self.db.set_setting("digest_last_run", str(int(time.time())))
+        self.mailer.wake()
+        return result
+
+    def _on_mail_error(self, subject: str, error: str, retry_in: Optional[int]):
+        if retry_in is None:
+            self.toast(f"Письмо не отправлено: {subject}: {error}")
+        else:
+            self.toast(f"Ошибка e-mail: {error}, повтор через {retry_in} с")
 
-        # done message
-        self.confirm(self.checklist.get("finish_message","Разрешена фрезеровка детали..."),
-                     yes_text="OK", no_text="", on_yes=lambda *_: self.back_to_start())
+    def outbox_status(self) -> str:
+        st = self.mailer.stats()
+        text = f"В очереди: {st['queued']}, не отправлено: {st['failed']}"
+        if st["last_error"]:
+            text += f", последняя ошибка: {st['last_error']}"
+        return text
+
+    def resend_outbox(self):
+        n = self.mailer.retry_now(include_failed=True)
+        self.toast(f"Повторная отправка: {n}" if n else self.outbox_status())
 
     # ---------- History ----------
-    def refresh_history(self, order_like: str):
-        scr = self.root.get_screen("history")
-        lst = scr.ids.history_list
-        lst.clear_widgets()
-        for r in self.db.list_reports(order_like or None):
-            text = f"{r['id']:04d} — {r['order_no']} — {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(r['created_at']))}"
-            sec = os.path.basename(r["file_path"])
-            item = ThreeLineListItem(text=text, secondary_text=sec, tertiary_text=r["file_path"])
-            item.bind(on_release=lambda inst, path=r["file_path"]: self.open_pdf(path))
-            lst.add_widget(item)
+    def refresh_history(self, query: str):
+        # called on every keystroke of the filter field: query only once typing pauses
+        if self.history_ev:
+            self.history_ev.cancel()
+        self.history_ev = Clock.schedule_once(lambda dt: self._reload_history(query), HISTORY_FILTER_DELAY)
+
+    def _reload_history(self, query: str):
+        self.history_query = query or ""
+        self.history_cursor = None
+        self.history_rv.data = []
+        self._load_history_page()
+        self.history_rv.scroll_y = 1
+
+    def _load_history_page(self):
+        rows = self.db.list_reports(self.history_query or None, limit=HISTORY_PAGE_SIZE, after=self.history_cursor)
+        self.history_rv.data.extend(self._make_history_row(r) for r in rows)
+        self.history_cursor = self.db.report_cursor(rows[-1]) if len(rows) == HISTORY_PAGE_SIZE else None
+
+    def _on_history_scroll(self, rv, scroll_y):
+        # near the bottom of the loaded rows -> fetch the next page
+        if scroll_y <= 0.05 and self.history_cursor is not None:
+            self._load_history_page()
+
+    def _make_history_row(self, r) -> Dict[str, Any]:
+        text = f"{r['id']:04d} — {r['order_no']} — {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(r['created_at']))}"
+        return {"text": text, "secondary_text": os.path.basename(r["file_path"]),
+                "tertiary_text": r["file_path"], "file_path": r["file_path"]}
 
     def open_pdf(self, path: str):
         # On Android, let OS handle via file chooser / intent — here we just toast path
@@ -315,7 +638,7 @@ class CNCChecklistApp(MDApp):
                 return
             # ask for new pin (twice)
             self.ask_new_pin(role=role)
-        self.ask_pin(role="admin", on_ok=after_admin)
+        self.ask_pin(role="admin", on_ok=after_admin, purpose=f"change_pin:{role}")
 
     def ask_new_pin(self, role: str):
         from kivymd.uix.dialog import MDDialog
@@ -333,13 +656,15 @@ class CNCChecklistApp(MDApp):
             if not (4 <= len(p1) <= 8) or p1 != p2:
                 self.toast("PIN 4-8 цифр и должны совпадать")
                 return
-            h, s = pbkdf2_hash(p1)
-            self.db.set_setting(f"{role}_pin_hash", h.hex())
-            self.db.set_setting(f"{role}_pin_salt", s.hex())
-            self.db.set_setting("pins_must_change", "0")
-            self.db.log("AUDIT", "pin_change", {"role": role})
-            self.toast("PIN сохранён")
-            dlg.dismiss()
+            def store():
+                values = pin_settings(role, p1, target_kdf(self.db))
+                with self.db.transaction():
+                    self.db.set_settings(dict(values, pins_must_change="0"))
+                    self.db.log("AUDIT", "pin_change", {"role": role})
+            def stored(_):
+                self.toast("PIN сохранён")
+                dlg.dismiss()
+            self._in_background(store, stored, on_error=lambda err: self.toast(f"Ошибка сохранения PIN: {err}"))
         dlg.open()
 
     def choose_save_dir(self):
@@ -384,79 +709,104 @@ class CNCChecklistApp(MDApp):
                         self.toast("Выбор папки недоступен")
             except Exception as e:
                 self.toast(f"Ошибка выбора папки: {e}")
-        self.ask_pin(role="admin", on_ok=after_admin)
+        self.ask_pin(role="admin", on_ok=after_admin, purpose="save_dir")
 
     def open_email_settings_dialog(self):
         def after_admin(ok: bool):
             if not ok:
                 return
             # simple dialog asking for fields sequentially is lengthy; here set flags to defaults if empty
-            for key, val in {
-                "email_enabled": "1",
-                "smtp_host": self.db.get_setting("smtp_host") or "",
-                "smtp_port": self.db.get_setting("smtp_port") or "465",
-                "smtp_ssl": self.db.get_setting("smtp_ssl") or "1",
-                "smtp_tls": self.db.get_setting("smtp_tls") or "0",
-                "smtp_user": self.db.get_setting("smtp_user") or "",
-                "smtp_pass": self.db.get_setting("smtp_pass") or "",
-                "recipients": self.db.get_setting("recipients") or "",
-            }.items():
-                self.db.set_setting(key, val)
+            defaults = {"smtp_port": "465", "smtp_ssl": "1", "smtp_tls": "0"}
+            current = self.db.get_settings(SMTP_KEYS)
+            values = {key: current[key] or defaults.get(key, "") for key in SMTP_KEYS}
+            values["email_enabled"] = "1"
+            self.db.set_settings(values)
+            # queued mail may have been waiting for working settings
+            self.mailer.retry_now()
             self.toast("Параметры e-mail сохранены (заглушка). Отредактируйте в БД или добавим форму позже.")
-        self.ask_pin(role="admin", on_ok=after_admin)
+        self.ask_pin(role="admin", on_ok=after_admin, purpose="email_settings")
 
     def test_pdf(self):
         sess = self.db.get_active_session()
         if not sess:
             self.toast("Нет активной сессии")
             return
-        steps = self.db.get_steps(sess["id"])
-        photos_by_step = {}
-        for st in steps:
-            phs = [r["file_path"] for r in self.db.get_photos_for_step(st["id"])]
-            if phs:
-                photos_by_step[st["id"]] = phs
         seq = self.db.bump_report_seq()
-        path = generate_pdf(self.db, sess, steps, photos_by_step, self.save_dir, seq, self.checklist.get("version","1.0"))
-        self.db.add_report(sess["id"], seq, path)
-        self.toast(f"PDF: {os.path.basename(path)}")
+        steps = self.state.snapshot() if self.state and self.state.session_id == sess["id"] else None
+        self._run_report_job({"session_id": sess["id"], "seq": seq, "save_dir": self.save_dir,
+                              "checklist_version": self.checklist.version},
+                             on_done=lambda result: self.toast(f"PDF: {os.path.basename(result['file'])}"),
+                             steps=steps)
 
     def test_email(self):
-        try:
-            settings = {
-                "smtp_host": self.db.get_setting("smtp_host"),
-                "smtp_port": self.db.get_setting("smtp_port"),
-                "smtp_user": self.db.get_setting("smtp_user"),
-                "smtp_pass": self.db.get_setting("smtp_pass"),
-                "smtp_ssl": self.db.get_setting("smtp_ssl"),
-                "smtp_tls": self.db.get_setting("smtp_tls"),
-                "recipients": self.db.get_setting("recipients"),
-            }
-            dummy = os.path.join(APP_DIR, "assets", "icon.png")
-            send_email_with_attachment(settings, "Test CNC Checklist", "Проверка отправки", dummy)
-            self.toast("Тестовое письмо отправлено")
-        except Exception as e:
-            self.toast(f"Ошибка e-mail: {e}")
-            self.db.log("ERROR", "email_send_test", {"error": str(e)})
-
-    def export_logs_csv(self):
-        path = os.path.join(self.save_dir or APP_DIR, f"logs_{int(time.time())}.csv")
-        import sqlite3, csv
-        con = self.db.conn
-        rows = con.execute("SELECT ts, level, action, details FROM logs ORDER BY id DESC").fetchall()
-        with open(path, "w", encoding="utf-8", newline="") as f:
-            w = csv.writer(f, delimiter=";")
-            w.writerow(["ts","level","action","details_json"])
-            for r in rows:
-                w.writerow([r["ts"], r["level"], r["action"], r["details"]])
-        self.toast(f"Логи экспортированы: {os.path.basename(path)}")
+        dummy = os.path.join(APP_DIR, "assets", "icon.png")
+        self.mailer.send("Test CNC Checklist", "Проверка отправки", [dummy], log_action="email_send_test")
+        self.toast(f"Тестовое письмо в очереди. {self.outbox_status()}")
+
+    def export_logs_csv(self, since: Optional[int] = None, until: Optional[int] = None,
+                        levels: Optional[List[str]] = None, actions: Optional[List[str]] = None,
+                        compress: Optional[bool] = None):
+        if compress is None:
+            compress = (self.db.get_setting("log_export_gzip") or "0") == "1"
+        path = os.path.join(self.save_dir or APP_DIR, f"logs_{int(time.time())}.csv" + (".gz" if compress else ""))
+        self.jobs.submit("log_export", {"path": path, "since": since, "until": until, "levels": levels,
+                                        "actions": actions, "compress": compress},
+                         on_done=lambda res: self.toast(f"Логи экспортированы: {os.path.basename(res['file'])} ({res['rows']})"),
+                         on_error=lambda err: self.toast(f"Ошибка экспорта логов: {err}"))
+
+    def _job_log_export(self, job, path: str, since=None, until=None, levels=None, actions=None, compress=False):
+        rows = export_logs(self.db, path, since=since, until=until, levels=levels, actions=actions,
+                           compress=compress, progress=job.progress)
+        return {"file": path, "rows": rows}
+
+    def _job_retention(self, job):
+        result = run_retention(self.db, os.path.join(APP_DIR, "archive"), os.path.join(APP_DIR, "photos"),
+                               outgoing_dir=os.path.join(APP_DIR, "outgoing"), progress=job.progress)
+        self.db.set_setting("retention_last_run", str(int(time.time())))
+        self.db.log("INFO", "retention", result)
+        return result
+
+    def compact_db(self):
+        # maintenance action: one-off full VACUUM of a database created before auto_vacuum
+        # (retention only releases free pages, it never rewrites the file at start-up)
+        if not self.db.needs_full_vacuum():
+            self.toast("База уже сжата")
+            return
+        self.jobs.submit("db_compact", on_error=lambda err: self.toast(f"Ошибка сжатия базы: {err}"),
+                         on_done=lambda res: self.toast(f"База сжата, освобождено {res['bytes_freed'] // 1024} КБ"))
+
+    def _job_db_compact(self, job):
+        job.progress(0.0, "Сжатие базы")
+        result = {"bytes_freed": self.db.reclaim_space(full=True)}
+        self.db.log("INFO", "db_compact", result)
+        return result
 
     # ---------- PIN dialogs ----------
-    def ask_pin(self, role: str, on_ok):
-        # role: 'admin' or 'master'
+    def admin_granted(self) -> bool:
+        return time.monotonic() < self.admin_grant_until
+
+    def _grant_admin(self, purpose: str):
+        ttl = int(self.db.get_setting("admin_grant_ttl") or ADMIN_GRANT_TTL)
+        if ttl > 0:
+            self.admin_grant_until = time.monotonic() + ttl
+            self.db.log("AUDIT", "admin_grant", {"ttl": ttl, "purpose": purpose})
+
+    def revoke_admin_grant(self, reason: str):
+        if self.admin_granted():
+            self.db.log("AUDIT", "admin_grant_revoke", {"reason": reason})
+        self.admin_grant_until = 0.0
+
+    def ask_pin(self, role: str, on_ok, purpose: str = ""):
+        # role: 'admin' or 'master'; purpose goes to the audit log.
+        # A verified admin PIN is honoured for admin_grant_ttl seconds (until pause / leaving settings).
+        if role == "admin" and self.admin_granted():
+            self.db.log("AUDIT", "admin_grant_use", {"purpose": purpose,
+                                                     "remaining_sec": int(self.admin_grant_until - time.monotonic())})
+            on_ok(True)
+            return
         from kivymd.uix.dialog import MDDialog
         from kivymd.uix.textfield import MDTextField
-        from kivy.core.window import Window
+        from kivymd.uix.spinner import MDSpinner
         layout = MDBoxLayout(orientation="vertical", spacing=dp(8), adaptive_height=True)
         pin = MDTextField(hint_text=f"{role}-PIN", password=True)
         name_field = None
@@ -464,23 +814,41 @@ class CNCChecklistApp(MDApp):
             name_field = MDTextField(hint_text="ФИО мастера (для журнала)")
             layout.add_widget(name_field)
         layout.add_widget(pin)
+        spinner = MDSpinner(size_hint=(None, None), size=(dp(32), dp(32)), pos_hint={"center_x": .5},
+                            active=False, opacity=0)
+        layout.add_widget(spinner)
+        closed = []
+        def cancel():
+            closed.append(True)
+            dlg.dismiss()
+            on_ok(False)
+        ok_button = MDRaisedButton(text="OK", on_release=lambda *_: submit())
         dlg = MDDialog(title=f"Введите {role}-PIN", type="custom", content_cls=layout,
                        auto_dismiss=False,
-                       buttons=[MDFlatButton(text="Отмена", on_release=lambda *_: (dlg.dismiss(), on_ok(False))),
-                                MDRaisedButton(text="OK", on_release=lambda *_: submit())])
+                       buttons=[MDFlatButton(text="Отмена", on_release=lambda *_: cancel()), ok_button])
+        def busy(on: bool):
+            spinner.active = on
+            spinner.opacity = 1 if on else 0
+            ok_button.disabled = on
+            pin.disabled = on
         def submit():
-            p = pin.text.strip()
-            h = self.db.get_setting(f"{role}_pin_hash")
-            s = self.db.get_setting(f"{role}_pin_salt")
+            # PBKDF2 takes ~pin_kdf_target_ms: verify on a thread, the dialog shows a spinner meanwhile
+            busy(True)
+            self._in_background(partial(check_pin, self.db, role, pin.text.strip()), checked,
+                                on_error=lambda err: (busy(False), self.toast(f"Ошибка проверки PIN: {err}")))
+        def checked(ok):
+            if closed:
+                return
+            busy(False)
             # handle 5 tries lock not implemented fully: would store counter+timestamp in settings
-            if not h or not s:
+            if ok is None:
                 self.toast("PIN не настроен")
                 dlg.dismiss()
                 on_ok(False)
-                return
-            from security import verify_pin
-            if verify_pin(p, h, s):
+            elif ok:
                 dlg.dismiss()
+                if role == "admin":
+                    self._grant_admin(purpose)
                 if role == "master":
                     on_ok(True, name_field.text.strip() if name_field else None)
                 else:
@@ -489,6 +857,19 @@ class CNCChecklistApp(MDApp):
                 self.toast("Неверный PIN")
         dlg.open()
 
+    def _in_background(self, fn, on_done, on_error=None):
+        # short UI-blocking work (PIN hashing) on a plain thread; not a job: its arguments must not be persisted
+        def run():
+            try:
+                result = fn()
+            except Exception as e:
+                err = str(e)
+                if on_error:
+                    Clock.schedule_once(lambda dt: on_error(err))
+                return
+            Clock.schedule_once(lambda dt: on_done(result))
+        threading.Thread(target=run, daemon=True).start()
+
     # ---------- utils ----------
     def toast(self, text: str):
         Snackbar(text=text, duration=2).open()
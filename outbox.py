@@ -0,0 +1,167 @@
+
+import json, threading, time
+from typing import Any, Callable, Dict, List, Optional
+
+# Outbox: mail is queued in the `outbox` table and sent by one background thread, so a
+# report survives network outages and app restarts. The authenticated SMTP connection is
+# reused across queued messages and closed after IDLE_TIMEOUT without work. Transient
+# failures (network, server busy, settings not filled in yet) are retried with exponential
+# backoff, at most MAX_ATTEMPTS times; a rejection of the message itself (attachment gone,
+# 5xx for recipients/data) or running out of attempts marks it failed -
+# retry_now(include_failed=True) revives it with a fresh attempt budget.
+# email_utils (smtplib, ssl) is imported on first send, not at app start.
+
+RETRY_BASE_DELAY = 30   # s, first retry, doubled per attempt
+RETRY_MAX_DELAY = 1800
+MAX_ATTEMPTS = 50       # ~1 day of retries at the RETRY_MAX_DELAY cadence
+IDLE_TIMEOUT = 60       # s, idle connection is closed (servers drop it after a few minutes anyway)
+
+def _permanent(e: Exception) -> bool:
+    import smtplib
+    if isinstance(e, (FileNotFoundError, IsADirectoryError)):
+        return True
+    if isinstance(e, smtplib.SMTPAuthenticationError):
+        # settings problem, every message would fail: keep them queued until it is fixed
+        return False
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return True
+    if isinstance(e, smtplib.SMTPResponseException):
+        return 500 <= e.smtp_code < 600
+    return False
+
+class MailSender:
+    def __init__(self, db, settings: Callable[[], Dict[str, Any]], dispatch: Optional[Callable[[Callable], Any]] = None,
+                 on_sent: Optional[Callable[[str], None]] = None,
+                 on_error: Optional[Callable[[str, str, Optional[int]], None]] = None,
+                 base_delay: int = RETRY_BASE_DELAY, max_delay: int = RETRY_MAX_DELAY,
+                 max_attempts: int = MAX_ATTEMPTS, idle_timeout: float = IDLE_TIMEOUT):
+        # on_sent(subject); on_error(subject, error, retry_in_sec or None when given up)
+        self.db = db
+        self.settings = settings
+        self.dispatch = dispatch or (lambda fn: fn())
+        self.on_sent = on_sent
+        self.on_error = on_error
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.idle_timeout = idle_timeout
+        self.last_error: Optional[str] = None
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._conn = None
+        self._conn_settings: Optional[Dict[str, Any]] = None
+        self._last_used = 0.0
+
+    def start(self):
+        if self._thread:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="mail-sender", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        thread, self._thread = self._thread, None
+        if thread:
+            self._stopping = True
+            self._wake.set()
+            thread.join(timeout)
+
+    def wake(self):
+        self._wake.set()
+
+    def send(self, subject: str, body: str, attachments: List[str], log_action: str = "email_send") -> int:
+        mail_id = self.db.enqueue_mail(subject, body, attachments, log_action)
+        self.wake()
+        return mail_id
+
+    def retry_now(self, include_failed: bool = False) -> int:
+        # e.g. after the SMTP settings were corrected
+        n = self.db.requeue_mail(include_failed)
+        self.wake()
+        return n
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.db.outbox_stats()
+        stats["last_error"] = self.last_error or stats["last_error"]
+        stats["connected"] = self._conn is not None
+        return stats
+
+    def _notify(self, cb, *args):
+        if cb:
+            self.dispatch(lambda: cb(*args))
+
+    def _run(self):
+        while not self._stopping:
+            # cleared before the query: a wake() arriving after it makes the wait return at once
+            self._wake.clear()
+            now = int(time.time())
+            row = self.db.next_mail(now)
+            if row is not None:
+                self._deliver(row)
+                continue
+            due = self.db.next_mail_due()
+            timeout = None if due is None else max(0, due - now)
+            if self._conn is not None:
+                timeout = min(timeout, self.idle_timeout) if timeout is not None else self.idle_timeout
+            self._wake.wait(timeout)
+            if self._conn is not None and time.monotonic() - self._last_used >= self.idle_timeout:
+                self._close()
+        self._close()
+
+    def _deliver(self, row):
+        attachments = json.loads(row["attachments"] or "[]")
+        try:
+            from email_utils import build_message
+            settings = self.settings()
+            msg = build_message(settings, row["subject"], row["body"] or "", attachments)
+            self._send(settings, msg)
+        except Exception as e:
+            err = str(e) or e.__class__.__name__
+            self.last_error = err
+            self._close()
+            attempt = row["attempts"] + 1
+            if _permanent(e) or attempt >= self.max_attempts:
+                self.db.mark_mail_failed(row["id"], err)
+                self.db.log("ERROR", row["log_action"], {"ok": False, "outbox_id": row["id"], "error": err,
+                                                          "attempt": attempt})
+                self._notify(self.on_error, row["subject"], err, None)
+            else:
+                delay = min(self.max_delay, self.base_delay * 2 ** row["attempts"])
+                self.db.mark_mail_retry(row["id"], err, int(time.time()) + delay)
+                self.db.log("ERROR", row["log_action"], {"ok": False, "outbox_id": row["id"], "error": err,
+                                                          "attempt": attempt, "retry_in": delay})
+                self._notify(self.on_error, row["subject"], err, delay)
+            return
+        self.last_error = None
+        self.db.mark_mail_sent(row["id"])
+        self.db.log("INFO", row["log_action"], {"ok": True, "outbox_id": row["id"], "files": attachments})
+        self._notify(self.on_sent, row["subject"])
+
+    def _send(self, settings: Dict[str, Any], msg):
+        import smtplib
+        from email_utils import smtp_connect
+        if self._conn is not None and settings != self._conn_settings:
+            self._close()
+        if self._conn is not None:
+            try:
+                self._conn.send_message(msg)
+                self._last_used = time.monotonic()
+                return
+            except smtplib.SMTPServerDisconnected:
+                # the server dropped the kept connection: reconnect once, not a failed attempt
+                self._close()
+        self._conn = smtp_connect(settings)
+        self._conn_settings = settings
+        self._conn.send_message(msg)
+        self._last_used = time.monotonic()
+
+    def _close(self):
+        conn, self._conn = self._conn, None
+        self._conn_settings = None
+        if conn is None:
+            return
+        try:
+            conn.quit()
+        except Exception:
+            conn.close()
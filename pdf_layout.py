@@ -0,0 +1,50 @@
+
+from functools import lru_cache
+from typing import List, Sequence, Tuple
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+# Text measuring and pagination for pdf_report. Word widths are cached per (text, font, size)
+# for the life of the process, so checklist texts are measured once, not once per report.
+# Lines are broken greedily from the cached word widths (linear in the number of words;
+# reportlab widths are additive, no kerning). Rows are measured before anything is drawn
+# and paginate() decides the page breaks up front.
+
+@lru_cache(maxsize=8192)
+def text_width(text: str, font_name: str, font_size: float) -> float:
+    return stringWidth(text, font_name, font_size)
+
+@lru_cache(maxsize=2048)
+def wrap_text(text: str, font_name: str, font_size: float, max_width: float) -> Tuple[str, ...]:
+    space = text_width(" ", font_name, font_size)
+    lines: List[str] = []
+    line: List[str] = []
+    width = 0.0
+    for word in text.split():
+        w = text_width(word, font_name, font_size)
+        if line and width + space + w > max_width:
+            lines.append(" ".join(line))
+            line, width = [word], w
+        else:
+            width = width + space + w if line else w
+            line.append(word)
+    if line:
+        lines.append(" ".join(line))
+    return tuple(lines)
+
+def line_height(font_size: float) -> float:
+    return font_size + 2
+
+def text_height(lines: Sequence[str], font_size: float) -> float:
+    return len(lines) * line_height(font_size)
+
+def paginate(heights: Sequence[float], y: float, top: float, bottom: float) -> List[Tuple[bool, float]]:
+    # For each block of the given height: (starts a new page, y of its top edge).
+    # Blocks are never split; one taller than a page gets a page of its own and overflows.
+    plan = []
+    for h in heights:
+        new_page = y - h < bottom and y < top
+        if new_page:
+            y = top
+        plan.append((new_page, y))
+        y -= h
+    return plan
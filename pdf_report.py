@@ -1,6 +1,6 @@
 
-import os, io, time, textwrap
-from typing import Dict, Any, List
+import os, io, time, math, textwrap, threading
+from typing import Dict, Any, List, Optional, Callable, Tuple
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4, landscape
 from reportlab.lib.units import mm
@@ -8,6 +8,19 @@ from reportlab.lib.utils import ImageReader
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from PIL import Image
+from pdf_layout import line_height, paginate, text_height, wrap_text
+
+# Photo preprocessing pool: threads (PIL releases the GIL while decoding, resizing and
+# encoding; forking the multi-threaded app could deadlock the children on inherited locks).
+# One worker decodes a full-size camera frame at a time, budget ~160 MB per worker
+# (12 MP RGB decode + resize buffers).
+PHOTO_WORKER_MEM = 160 * 1024 * 1024
+PHOTO_MAX_WORKERS = 4
+
+# Photo (max_dim, quality) profiles, best first. The first one is the archive report;
+# fit_report() steps down the list when an e-mail attachment has to fit a size budget.
+PHOTO_PROFILES: Tuple[Tuple[int, int], ...] = ((1600, 80), (1280, 70), (1024, 60), (800, 50))
+READY_JPEG_QUALITY = 80  # photo_ingest.REPORT_QUALITY: derivatives are good enough for this quality or lower
 
 FONT_PATHS = [
     os.path.join("assets","DejaVuSans.ttf"),
@@ -15,7 +28,18 @@ FONT_PATHS = [
     "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
 ]
 
+_font_lock = threading.Lock()
+_font_name: Optional[str] = None
+
 def _load_font_or_fallback():
+    # registered once per process (TTFont parses the whole file); reports may render on several job threads
+    global _font_name
+    with _font_lock:
+        if _font_name is None:
+            _font_name = _register_font()
+        return _font_name
+
+def _register_font():
     for p in FONT_PATHS:
         if os.path.exists(p):
             try:
@@ -36,24 +60,6 @@ def _fmt_ts(ts):
         return "-"
     return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))
 
-def _wrap(c, text, x, y, max_width_pt, font_name, font_size):
-    # crude wrapper: split by words, draw multiple lines
-    words = text.split()
-    line = ""
-    lh = font_size + 2
-    for w in words:
-        test = (line + " " + w).strip()
-        if c.stringWidth(test, font_name, font_size) <= max_width_pt:
-            line = test
-        else:
-            c.drawString(x, y, line)
-            y -= lh
-            line = w
-    if line:
-        c.drawString(x, y, line)
-        y -= lh
-    return y
-
 def compress_image_to_jpeg(src_path: str, max_dim: int = 1600, quality: int = 80) -> bytes:
     im = Image.open(src_path)
     im = im.convert("RGB")
@@ -65,11 +71,114 @@ def compress_image_to_jpeg(src_path: str, max_dim: int = 1600, quality: int = 80
     im.save(buf, format="JPEG", quality=quality, optimize=True)
     return buf.getvalue()
 
-def generate_pdf(db, session, steps, photos_by_step: Dict[int, List[str]], save_dir: str, seq: int, checklist_version: str):
+def _ready_jpeg(src_path: str, max_dim: int) -> Optional[bytes]:
+    # ingest derivatives (photo_ingest.py) are already upright report-size JPEGs: embed as is.
+    # Only the header is parsed here, no pixel decode.
+    try:
+        with Image.open(src_path) as im:
+            if im.format != "JPEG" or max(im.size) > max_dim or im.getexif().get(0x0112, 1) != 1:
+                return None
+        with open(src_path, "rb") as f:
+            return f.read()
+    except Exception:
+        return None
+
+def _compress_or_none(args):
+    # pool task: unreadable/corrupt photos are skipped in the report, not fatal
+    src_path, max_dim, quality = args
+    try:
+        return compress_image_to_jpeg(src_path, max_dim=max_dim, quality=quality)
+    except Exception:
+        return None
+
+def _available_memory() -> Optional[int]:
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def _photo_pool_size(n_photos: int, max_workers: Optional[int] = None) -> int:
+    # leave one core for the UI; cap by free memory so a low-end tablet is not pushed into OOM
+    cpus = os.cpu_count() or 1
+    workers = min(PHOTO_MAX_WORKERS if max_workers is None else max_workers, max(1, cpus - 1), n_photos)
+    avail = _available_memory()
+    if avail is not None:
+        workers = min(workers, avail // PHOTO_WORKER_MEM)
+    return max(1, workers)
+
+def prepare_photos(photos_by_step: Dict[int, List[str]], max_dim: int = 1600, quality: int = 80, cache=None,
+                   max_workers: Optional[int] = None,
+                   progress: Optional[Callable[[float, str], None]] = None) -> Dict[str, Optional[bytes]]:
+    # Returns {path: jpeg bytes or None}. Ready derivatives and cache hits are served directly, misses are
+    # compressed in a thread pool (or serially with a single worker).
+    progress = progress or (lambda fraction, text="": None)
+    paths = list(dict.fromkeys(p for phs in photos_by_step.values() for p in phs))
+    prepared: Dict[str, Optional[bytes]] = {}
+    todo = []
+    for p in paths:
+        data = _ready_jpeg(p, max_dim) if quality >= READY_JPEG_QUALITY else None
+        if data is None and cache is not None:
+            data = cache.get(p, max_dim, quality)
+        if data is not None:
+            prepared[p] = data
+        else:
+            todo.append(p)
+
+    def _store(p, data):
+        prepared[p] = data
+        if data is not None and cache is not None:
+            cache.put(p, max_dim, quality, data)
+        progress(len(prepared) / max(1, len(paths)), "Обработка фото")
+
+    workers = _photo_pool_size(len(todo), max_workers)
+    if workers > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="photo")
+        try:
+            for p, data in zip(todo, pool.map(_compress_or_none, [(p, max_dim, quality) for p in todo])):
+                _store(p, data)
+        finally:
+            # progress() may raise (job cancelled): drop what has not started yet
+            pool.shutdown(wait=False, cancel_futures=True)
+    else:
+        for p in todo:
+            _store(p, _compress_or_none((p, max_dim, quality)))
+    return prepared
+
+TABLE_HEAD_HEIGHT = 7*mm
+TABLE_HEADERS = ["Блок", "Пункт", "Статус", "Текст", "Начато", "Окончено", "Длит.,с", "Крит.", "Обход"]
+
+def _define_table_head(c, font_name, width, margin, col_x):
+    # Column headers repeat on every table page: a form XObject stores their content stream
+    # once per document and each page only references it (/Name Do).
+    c.beginForm("table_head", lowery=-TABLE_HEAD_HEIGHT, uppery=12)
+    c.setFont(font_name, 9)
+    for cx, h in zip(col_x, TABLE_HEADERS):
+        c.drawString(cx, 0, h)
+    c.line(margin, -3*mm, width - margin, -3*mm)
+    c.endForm()
+
+def generate_pdf(db, session, steps, photos_by_step: Dict[int, List[str]], save_dir: str, seq: int, checklist_version: str,
+                 progress: Optional[Callable[[float, str], None]] = None, photo_cache=None,
+                 photo_workers: Optional[int] = None, photo_profile: Tuple[int, int] = PHOTO_PROFILES[0],
+                 part: Optional[Tuple[int, int]] = None):
+    # progress(fraction, text) is called between rows/photos; it may raise to abort rendering.
+    # part: (number, total) when photos_by_step is one share of a split report
+    progress = progress or (lambda fraction, text="": None)
+    max_dim, quality = photo_profile
+    # all photos are decoded/resized up front (in parallel where possible), layout only embeds bytes
+    prepared = prepare_photos(photos_by_step, max_dim=max_dim, quality=quality, cache=photo_cache,
+                              max_workers=photo_workers,
+                              progress=lambda fraction, text="": progress(0.7 * fraction, text))
     # File name
     started = _fmt_ts(session["started_at"])
     stamp = time.strftime("%Y-%m-%d_%H%M%S", time.localtime(time.time()))
-    fname = f"{stamp}_{session['order_no']}_nesting_{seq:04d}.pdf"
+    suffix = f"_part{part[0]}of{part[1]}" if part else ""
+    fname = f"{stamp}_{session['order_no']}_nesting_{seq:04d}{suffix}.pdf"
     out_path = os.path.join(save_dir, fname)
 
     font_name = _load_font_or_fallback()
@@ -81,6 +190,17 @@ def generate_pdf(db, session, steps, photos_by_step: Dict[int, List[str]], save_
     width, height = page_size
     x = margin
     y = height - margin
+    # Columns: Block# Item# Text | ✓/✗ | Start | End | Dur | Critical | Override | Note
+    col_x = [x, x+12*mm, x+22*mm, x+150*mm, x+165*mm, x+190*mm, x+205*mm, x+220*mm, x+235*mm]
+    _define_table_head(c, font_name, width, margin, col_x)
+
+    def table_head(y):
+        # column headers + rule, the form is drawn relative to the header baseline
+        c.saveState()
+        c.translate(0, y)
+        c.doForm("table_head")
+        c.restoreState()
+        return y - TABLE_HEAD_HEIGHT
 
     # Header
     c.setFont(font_name, 16)
@@ -95,6 +215,8 @@ def generate_pdf(db, session, steps, photos_by_step: Dict[int, List[str]], save_
         f"Версия чек-листа: {checklist_version}",
         f"Авто-номер отчёта (SEQ): {seq:04d}"
     ]
+    if part:
+        header.append(f"Часть {part[0]} из {part[1]} (фото {max_dim}px, качество {quality})")
     for line in header:
         c.drawString(x, y, line)
         y -= 5*mm
@@ -105,47 +227,38 @@ def generate_pdf(db, session, steps, photos_by_step: Dict[int, List[str]], save_
     c.drawString(x, y, "Таблица пунктов:")
     y -= 6*mm
     c.setFont(font_name, 9)
+    y = table_head(y)
 
-    # Columns: Block# Item# Text | ✓/✗ | Start | End | Dur | Critical | Override | Note
-    col_x = [x, x+12*mm, x+22*mm, x+150*mm, x+165*mm, x+190*mm, x+205*mm, x+220*mm, x+235*mm]
-    headers = ["Блок", "Пункт", "Статус", "Текст", "Начато", "Окончено", "Длит.,с", "Крит.", "Обход"]
-    for i, h in enumerate(headers):
-        c.drawString(col_x[i], y, h)
-    y -= 5*mm
-    c.line(x, y+2*mm, width - margin, y+2*mm)
-    y -= 2*mm
-
-    # Rows
-    block_item_counters = {}
-    for st in steps:
+    # Rows: measured first, page breaks planned before drawing; continuation pages repeat the column headers
+    text_w = (width - margin) - col_x[3]
+    lh = line_height(9)
+    row_lines = [wrap_text(st["text"], font_name, 9, text_w) or ("",) for st in steps]
+    plan = paginate([text_height(lines, 9) + 2*mm for lines in row_lines], y,
+                    height - margin - TABLE_HEAD_HEIGHT, margin)
+    for n, (st, lines, (new_page, y)) in enumerate(zip(steps, row_lines, plan)):
+        progress(0.7 + 0.1 * n / max(1, len(steps)), "Таблица пунктов")
+        if new_page:
+            c.showPage()
+            c.setFont(font_name, 9)
+            table_head(height - margin)
         bi = st["block_index"]
         ii = st["item_index"]
         status = st["status"]
         status_char = "✓" if status=="done" else ("✗" if status=="failed" else ("…"))
-        started_at = _fmt_ts(st["started_at"])
-        completed_at = _fmt_ts(st["completed_at"])
-        duration = str(st["duration_sec"] or "-")
-        crit = "Да" if st["critical"] else "-"
-        override = "Да" if st["override_by_master"] else "-"
 
         # block and item numbers humanized
         c.drawString(col_x[0], y, str(bi+1))
         c.drawString(col_x[1], y, str(ii+1))
         c.drawString(col_x[2], y, status_char)
-
-        # wrap text
-        y = _wrap(c, st["text"], col_x[3], y, (width - margin) - col_x[3], font_name, 9)
+        for k, line in enumerate(lines):
+            c.drawString(col_x[3], y - k * lh, line)
         # smaller columns for times on the last printed line
-        c.drawString(col_x[4], y+9, started_at)
-        c.drawString(col_x[5], y+9, completed_at)
-        c.drawString(col_x[6], y+9, duration)
-        c.drawString(col_x[7], y+9, crit)
-        c.drawString(col_x[8], y+9, override)
-        y -= 2*mm
-        if y < 40*mm:
-            c.showPage()
-            y = height - margin
-            c.setFont(font_name, 9)
+        last = y - (len(lines) - 1) * lh
+        c.drawString(col_x[4], last, _fmt_ts(st["started_at"]))
+        c.drawString(col_x[5], last, _fmt_ts(st["completed_at"]))
+        c.drawString(col_x[6], last, str(st["duration_sec"] or "-"))
+        c.drawString(col_x[7], last, "Да" if st["critical"] else "-")
+        c.drawString(col_x[8], last, "Да" if st["override_by_master"] else "-")
 
     # Photos per block
     c.showPage()
@@ -155,41 +268,84 @@ def generate_pdf(db, session, steps, photos_by_step: Dict[int, List[str]], save_
     y -= 8*mm
     c.setFont(font_name, 9)
 
+    # up to 3 images per row; a step title is kept on the page of its first image row
+    cell_w = (width - 2*margin) / 3 - 5*mm
+    cell_h = 45*mm
+    blocks = []  # (title lines or None, images of one row)
     for st in steps:
-        pid = st["id"]
-        phs = photos_by_step.get(pid, [])
-        if not phs:
+        images = [prepared[p] for p in photos_by_step.get(st["id"], []) if prepared.get(p) is not None]
+        if not images:
             continue
         title = f"Блок {st['block_index']+1}, пункт {st['item_index']+1}: {st['text']}"
-        y = _wrap(c, title, x, y, width - 2*margin, font_name, 9)
-        # place up to 3 images per row
-        cell_w = (width - 2*margin) / 3 - 5*mm
-        cell_h = 45*mm
-        col = 0
-        for p in phs:
+        for r in range(0, len(images), 3):
+            blocks.append((wrap_text(title, font_name, 9, width - 2*margin) if r == 0 else None, images[r:r + 3]))
+    row_h = cell_h + 5*mm
+    plan = paginate([row_h + (text_height(t, 9) if t else 0) for t, _ in blocks], y, height - margin, margin)
+    total_photos = sum(len(images) for _, images in blocks)
+    done_photos = 0
+    for (title, images), (new_page, y) in zip(blocks, plan):
+        progress(0.8 + 0.1 * done_photos / max(1, total_photos), "Фото")
+        done_photos += len(images)
+        if new_page:
+            c.showPage()
+            c.setFont(font_name, 9)
+        if title:
+            for k, line in enumerate(title):
+                c.drawString(x, y - k * lh, line)
+            y -= text_height(title, 9)
+        for col, jpeg_bytes in enumerate(images):
             try:
-                jpeg_bytes = compress_image_to_jpeg(p, max_dim=1600, quality=80)
                 img = ImageReader(io.BytesIO(jpeg_bytes))
-                ix = x + col * (cell_w + 5*mm)
-                iy = y - cell_h
-                c.drawImage(img, ix, iy, width=cell_w, height=cell_h, preserveAspectRatio=True, anchor='sw')
-                col += 1
-                if col >= 3:
-                    col = 0
-                    y -= (cell_h + 5*mm)
-                    if y < 30*mm:
-                        c.showPage()
-                        y = height - margin
-                        c.setFont(font_name, 9)
+                c.drawImage(img, x + col * (cell_w + 5*mm), y - cell_h, width=cell_w, height=cell_h,
+                            preserveAspectRatio=True, anchor='sw')
             except Exception:
                 continue
-        if col != 0:
-            y -= (cell_h + 8*mm)
-        if y < 40*mm:
-            c.showPage()
-            y = height - margin
-            c.setFont(font_name, 9)
 
+    progress(0.95, "Сохранение PDF")
     c.showPage()
     c.save()
     return out_path
+
+def _remove_quietly(paths: List[str]):
+    for p in paths:
+        try:
+            os.remove(p)
+        except OSError:
+            pass
+
+def fit_report(render: Callable[[Tuple[int, int], Dict[int, List[str]], Optional[Tuple[int, int]]], str],
+               photos_by_step: Dict[int, List[str]], max_bytes: int, original_bytes: int,
+               progress: Optional[Callable[[float, str], None]] = None) -> Tuple[List[str], Tuple[int, int]]:
+    # Re-renders a report that is over max_bytes: first with the smaller photo profiles, then
+    # split into parts (photos spread over the parts in order, every part repeats header and table).
+    # render(profile, photos_by_step, part) -> pdf path. Returns (paths, profile used).
+    progress = progress or (lambda fraction, text="": None)
+    size = original_bytes
+    for i, profile in enumerate(PHOTO_PROFILES[1:]):
+        progress(0.5 * i / (len(PHOTO_PROFILES) - 1), f"Уменьшение фото до {profile[0]}px")
+        path = render(profile, photos_by_step, None)
+        size = os.path.getsize(path)
+        if size <= max_bytes:
+            return [path], profile
+        _remove_quietly([path])
+
+    profile = PHOTO_PROFILES[-1]
+    photos = [(step_id, p) for step_id, phs in photos_by_step.items() for p in phs]
+    parts = max(2, math.ceil(size / max_bytes))
+    while len(photos) > 1:
+        parts = min(parts, len(photos))
+        progress(0.5, f"Разделение на {parts} части")
+        paths = []
+        for k in range(parts):
+            share: Dict[int, List[str]] = {}
+            for step_id, p in photos[k * len(photos) // parts:(k + 1) * len(photos) // parts]:
+                share.setdefault(step_id, []).append(p)
+            paths.append(render(profile, share, (k + 1, parts)))
+        sizes = [os.path.getsize(p) for p in paths]
+        if max(sizes) <= max_bytes:
+            return paths, profile
+        _remove_quietly(paths)
+        if parts == len(photos):
+            break
+        parts = max(parts + 1, math.ceil(parts * max(sizes) / max_bytes))
+    raise RuntimeError(f"Отчёт не помещается в {max_bytes // 1024} КБ даже по частям")
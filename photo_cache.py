@@ -0,0 +1,129 @@
+
+import os, hashlib, threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+# On-disk cache of compressed photo derivatives used by the PDF report.
+# Entry key: absolute source path + mtime + size + max_dim + quality, so an edited or
+# replaced photo never hits a stale derivative. LRU order is kept in file mtimes
+# (touched on every hit) and survives restarts.
+
+class PhotoCache:
+    def __init__(self, root: str, max_bytes: int = 200 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # file name -> size, oldest first
+        self._total = 0
+        os.makedirs(self.root, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        found = []
+        for name in os.listdir(self.root):
+            p = os.path.join(self.root, name)
+            if not name.endswith(".jpg"):
+                # leftovers of interrupted writes
+                if name.endswith(".tmp"):
+                    try:
+                        os.remove(p)
+                    except OSError:
+                        pass
+                continue
+            try:
+                st = os.stat(p)
+            except OSError:
+                continue
+            found.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._total += size
+
+    def _key(self, src_path: str, max_dim: int, quality: int) -> Optional[str]:
+        try:
+            st = os.stat(src_path)
+        except OSError:
+            return None
+        raw = f"{os.path.abspath(src_path)}|{st.st_mtime_ns}|{st.st_size}|{max_dim}|{quality}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest() + ".jpg"
+
+    def get(self, src_path: str, max_dim: int, quality: int) -> Optional[bytes]:
+        name = self._key(src_path, max_dim, quality)
+        with self._lock:
+            if name is None or name not in self._entries:
+                self.misses += 1
+                return None
+            p = os.path.join(self.root, name)
+            try:
+                with open(p, "rb") as f:
+                    data = f.read()
+                os.utime(p, None)
+            except OSError:
+                self._drop(name)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+            return data
+
+    def put(self, src_path: str, max_dim: int, quality: int, data: bytes):
+        name = self._key(src_path, max_dim, quality)
+        if name is None or len(data) > self.max_bytes:
+            return
+        p = os.path.join(self.root, name)
+        tmp = f"{p}.{threading.get_ident()}.tmp"
+        with self._lock:
+            try:
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, p)
+            except OSError:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                return
+            if name in self._entries:
+                self._total -= self._entries[name]
+            self._entries[name] = len(data)
+            self._entries.move_to_end(name)
+            self._total += len(data)
+            self._evict()
+
+    def get_or_create(self, src_path: str, max_dim: int, quality: int,
+                      build: Callable[[str, int, int], bytes]) -> bytes:
+        data = self.get(src_path, max_dim, quality)
+        if data is None:
+            data = build(src_path, max_dim, quality)
+            self.put(src_path, max_dim, quality, data)
+        return data
+
+    def _evict(self):
+        while self._total > self.max_bytes and self._entries:
+            name = next(iter(self._entries))
+            self._drop(name)
+            try:
+                os.remove(os.path.join(self.root, name))
+            except OSError:
+                pass
+
+    def _drop(self, name: str):
+        size = self._entries.pop(name, None)
+        if size is not None:
+            self._total -= size
+
+    def clear(self):
+        with self._lock:
+            for name in list(self._entries):
+                self._drop(name)
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                    "bytes": self._total, "max_bytes": self.max_bytes}
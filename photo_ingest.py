@@ -0,0 +1,47 @@
+
+import os, hashlib
+from typing import Dict, Any
+from PIL import Image, ImageOps
+
+# Capture-time photo processing: runs as a background job right after DB.add_photo,
+# so report generation only has to embed ready JPEGs.
+REPORT_MAX_DIM = 1600
+REPORT_QUALITY = 80     # same profile as generate_pdf, derivatives are embedded as is
+THUMB_MAX_DIM = 256
+THUMB_QUALITY = 70
+
+_ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def ingest_photo(src_path: str, out_dir: str, photo_id: int) -> Dict[str, Any]:
+    os.makedirs(out_dir, exist_ok=True)
+    norm_path = os.path.join(out_dir, f"{photo_id}_norm.jpg")
+    thumb_path = os.path.join(out_dir, f"{photo_id}_thumb.jpg")
+    with Image.open(src_path) as im:
+        width, height = im.size
+        if im.getexif().get(0x0112) in _ROTATED_ORIENTATIONS:
+            width, height = height, width
+        # JPEG: let the decoder downscale by 1/2..1/8 instead of decoding the full frame
+        im.draft("RGB", (REPORT_MAX_DIM, REPORT_MAX_DIM))
+        norm = ImageOps.exif_transpose(im).convert("RGB")
+    norm.thumbnail((REPORT_MAX_DIM, REPORT_MAX_DIM))
+    norm.save(norm_path + ".tmp", format="JPEG", quality=REPORT_QUALITY, optimize=True)
+    os.replace(norm_path + ".tmp", norm_path)
+    thumb = norm.copy()
+    thumb.thumbnail((THUMB_MAX_DIM, THUMB_MAX_DIM))
+    thumb.save(thumb_path + ".tmp", format="JPEG", quality=THUMB_QUALITY)
+    os.replace(thumb_path + ".tmp", thumb_path)
+    return {
+        "norm_path": norm_path,
+        "thumb_path": thumb_path,
+        "width": width,
+        "height": height,
+        "byte_size": os.path.getsize(src_path),
+        "sha256": file_sha256(src_path),
+    }
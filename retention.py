@@ -0,0 +1,128 @@
+
+import gzip, json, os, time
+from typing import Callable, Dict, List, Optional
+
+# Data retention: aged log rows and completed sessions (steps, versions, photos, report rows)
+# are moved into gzip JSON-lines archives, then the space is reclaimed with incremental VACUUM
+# (the one-off full VACUUM of a pre-auto_vacuum database is the separate db_compact action).
+# PDF reports in save_dir are deliverables and are never touched; re-rendered e-mail
+# attachments in outgoing_dir are dropped together with the sent outbox rows.
+
+DEFAULT_LOG_DAYS = 180
+DEFAULT_SESSION_MONTHS = 12
+DAY = 24 * 3600
+MONTH = 30 * DAY
+
+def _policy(db, key: str, default: int) -> int:
+    # "0" in settings disables the policy; a value that is not a number falls back to the default
+    value = db.get_setting(key)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        db.log("WARN", "retention_policy", {"key": key, "value": value, "default": default})
+        return default
+
+def _inside(path: str, root: str) -> bool:
+    try:
+        return os.path.commonpath([os.path.abspath(path), os.path.abspath(root)]) == os.path.abspath(root)
+    except ValueError:
+        return False
+
+def _remove(path: Optional[str]) -> int:
+    if not path or not os.path.isfile(path):
+        return 0
+    size = os.path.getsize(path)
+    try:
+        os.remove(path)
+    except OSError:
+        return 0
+    return size
+
+def _archive_path(archive_dir: str, prefix: str, stamp: str) -> str:
+    path = os.path.join(archive_dir, f"{prefix}_{stamp}.jsonl.gz")
+    n = 1
+    while os.path.exists(path):
+        path = os.path.join(archive_dir, f"{prefix}_{stamp}_{n}.jsonl.gz")
+        n += 1
+    return path
+
+def _prune_dir(path: Optional[str], cutoff: int) -> int:
+    if not path or not os.path.isdir(path):
+        return 0
+    freed = 0
+    for name in os.listdir(path):
+        p = os.path.join(path, name)
+        try:
+            if os.path.getmtime(p) < cutoff:
+                freed += _remove(p)
+        except OSError:
+            pass
+    return freed
+
+def run_retention(db, archive_dir: str, photos_dir: str, log_days: Optional[int] = None,
+                  session_months: Optional[int] = None, now: Optional[int] = None, batch_size: int = 50,
+                  outgoing_dir: Optional[str] = None,
+                  progress: Optional[Callable[[float, str], None]] = None) -> Dict[str, int]:
+    # photos_dir: only photo files inside it (camera captures, derivatives) are deleted;
+    # images picked from elsewhere on desktop belong to the user.
+    progress = progress or (lambda fraction, text="": None)
+    now = int(time.time()) if now is None else now
+    log_days = _policy(db, "retention_log_days", DEFAULT_LOG_DAYS) if log_days is None else log_days
+    session_months = _policy(db, "retention_session_months", DEFAULT_SESSION_MONTHS) if session_months is None else session_months
+    os.makedirs(archive_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(now))
+    result = {"logs": 0, "sessions": 0, "jobs": 0, "outbox": 0, "photo_bytes": 0, "outgoing_bytes": 0, "db_bytes": 0, "archive_bytes": 0}
+    db_before = db.file_bytes()
+
+    if log_days > 0:
+        progress(0.0, "Архив журнала")
+        cutoff = now - log_days * DAY
+        db.flush_logs()
+        path = _archive_path(archive_dir, "logs", stamp)
+        max_id = 0
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            for r in db.iter_logs(until=cutoff):
+                f.write(json.dumps(dict(r), ensure_ascii=False) + "\n")
+                max_id = max(max_id, r["id"])
+        if max_id:
+            result["logs"] = db.delete_logs(cutoff, max_id)
+            result["archive_bytes"] += os.path.getsize(path)
+        else:
+            os.remove(path)
+        result["jobs"] = db.delete_finished_jobs(cutoff)
+        result["outbox"] = db.delete_sent_mail(cutoff)
+        result["outgoing_bytes"] = _prune_dir(outgoing_dir, cutoff)
+
+    if session_months > 0:
+        progress(0.3, "Архив сессий")
+        cutoff = now - session_months * MONTH
+        path = _archive_path(archive_dir, "sessions", stamp)
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            while True:
+                batch = db.list_sessions_completed_before(cutoff, limit=batch_size)
+                if not batch:
+                    break
+                files: List[str] = []
+                for sess in batch:
+                    record = db.dump_session(sess["id"])
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    for ph in record["photos"]:
+                        files += [ph["norm_path"], ph["thumb_path"]]
+                        if _inside(ph["file_path"], photos_dir):
+                            files.append(ph["file_path"])
+                # archive line is written before the rows go away
+                f.flush()
+                result["sessions"] += db.delete_sessions([s["id"] for s in batch])
+                result["photo_bytes"] += sum(_remove(p) for p in files if p and _inside(p, photos_dir))
+        if result["sessions"]:
+            result["archive_bytes"] += os.path.getsize(path)
+        else:
+            os.remove(path)
+
+    progress(0.8, "Сжатие базы")
+    db.reclaim_space()
+    result["db_bytes"] = max(0, db_before - db.file_bytes())
+    result["bytes_freed"] = result["db_bytes"] + result["photo_bytes"] + result["outgoing_bytes"]
+    return result
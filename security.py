@@ -1,27 +1,87 @@
 
-import os, hashlib, secrets, json
-from typing import Tuple, Optional
+import os, hashlib, hmac, secrets, json, time
+from typing import Any, Dict, Tuple, Optional
 
-def pbkdf2_hash(pin: str, salt: Optional[bytes] = None) -> Tuple[bytes, bytes]:
+# PIN hashes: {role}_pin_hash / {role}_pin_salt, KDF parameters in {role}_pin_kdf
+# ({"alg": "pbkdf2_sha256", "iterations": N}). Hashes stored before {role}_pin_kdf existed
+# used LEGACY_ITERATIONS. The target iteration count is calibrated once per device
+# (setting pin_kdf_iterations) so a check takes ~pin_kdf_target_ms; a PIN hashed with
+# other parameters is rehashed on its next successful check.
+# Checks take that long on purpose: call check_pin/pin_settings off the UI thread.
+
+KDF_ALG = "pbkdf2_sha256"
+LEGACY_ITERATIONS = 200_000
+MIN_ITERATIONS = 100_000
+MAX_ITERATIONS = 2_000_000
+DEFAULT_TARGET_MS = 300
+CALIBRATION_PROBE = 20_000
+
+def pbkdf2_hash(pin: str, salt: Optional[bytes] = None, iterations: int = LEGACY_ITERATIONS) -> Tuple[bytes, bytes]:
     if salt is None:
         salt = secrets.token_bytes(16)
-    dk = hashlib.pbkdf2_hmac('sha256', pin.encode('utf-8'), salt, 200_000)
+    dk = hashlib.pbkdf2_hmac('sha256', pin.encode('utf-8'), salt, iterations)
     return dk, salt
 
-def verify_pin(pin: str, stored_hash_hex: str, salt_hex: str) -> bool:
+def verify_pin(pin: str, stored_hash_hex: str, salt_hex: str, iterations: int = LEGACY_ITERATIONS) -> bool:
     salt = bytes.fromhex(salt_hex)
-    dk = hashlib.pbkdf2_hmac('sha256', pin.encode('utf-8'), salt, 200_000)
-    return dk.hex() == stored_hash_hex
+    dk = hashlib.pbkdf2_hmac('sha256', pin.encode('utf-8'), salt, iterations)
+    return hmac.compare_digest(dk.hex(), stored_hash_hex)
+
+def calibrate_iterations(target_ms: int = DEFAULT_TARGET_MS) -> int:
+    # best of 3 probes: scheduler noise only ever makes a probe slower
+    salt = secrets.token_bytes(16)
+    best = None
+    for _ in range(3):
+        t0 = time.perf_counter()
+        hashlib.pbkdf2_hmac('sha256', b"0000", salt, CALIBRATION_PROBE)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    iterations = int(CALIBRATION_PROBE * (target_ms / 1000.0) / max(best, 1e-6))
+    return max(MIN_ITERATIONS, min(MAX_ITERATIONS, iterations // 1000 * 1000))
+
+def target_kdf(db) -> Dict[str, Any]:
+    iterations = db.get_setting("pin_kdf_iterations")
+    if not iterations:
+        target_ms = int(db.get_setting("pin_kdf_target_ms") or DEFAULT_TARGET_MS)
+        iterations = str(calibrate_iterations(target_ms))
+        db.set_setting("pin_kdf_iterations", iterations)
+        db.log("INFO", "pin_kdf_calibrate", {"iterations": int(iterations), "target_ms": target_ms})
+    return {"alg": KDF_ALG, "iterations": int(iterations)}
+
+def stored_kdf(db, role: str) -> Dict[str, Any]:
+    raw = db.get_setting(f"{role}_pin_kdf")
+    return json.loads(raw) if raw else {"alg": KDF_ALG, "iterations": LEGACY_ITERATIONS}
+
+def pin_settings(role: str, pin: str, kdf: Dict[str, Any]) -> Dict[str, str]:
+    if kdf["alg"] != KDF_ALG:
+        raise ValueError(f"Unsupported KDF: {kdf['alg']}")
+    h, s = pbkdf2_hash(pin, iterations=kdf["iterations"])
+    return {f"{role}_pin_hash": h.hex(), f"{role}_pin_salt": s.hex(),
+            f"{role}_pin_kdf": json.dumps(kdf, sort_keys=True)}
+
+def check_pin(db, role: str, pin: str) -> Optional[bool]:
+    # None: no PIN configured for the role
+    values = db.get_settings((f"{role}_pin_hash", f"{role}_pin_salt"))
+    h, s = values[f"{role}_pin_hash"], values[f"{role}_pin_salt"]
+    if not h or not s:
+        return None
+    kdf = stored_kdf(db, role)
+    if kdf["alg"] != KDF_ALG or not verify_pin(pin, h, s, kdf["iterations"]):
+        return False
+    target = target_kdf(db)
+    if kdf != target:
+        db.set_settings(pin_settings(role, pin, target))
+        db.log("AUDIT", "pin_rehash", {"role": role, "from": kdf, "to": target})
+    return True
 
 def init_default_pins(db):
-    # If no pins, set defaults and require change on first admin open
+    # If no pins, set defaults and require change on first admin open.
+    # Legacy parameters here: calibration would delay the first start, the PINs are
+    # rehashed with the calibrated count on their first successful check.
+    kdf = {"alg": KDF_ALG, "iterations": LEGACY_ITERATIONS}
     if db.get_setting("master_pin_hash") is None:
-        h, s = pbkdf2_hash("2468")
-        db.set_setting("master_pin_hash", h.hex())
-        db.set_setting("master_pin_salt", s.hex())
+        db.set_settings(pin_settings("master", "2468", kdf))
     if db.get_setting("admin_pin_hash") is None:
-        h, s = pbkdf2_hash("8642")
-        db.set_setting("admin_pin_hash", h.hex())
-        db.set_setting("admin_pin_salt", s.hex())
+        db.set_settings(pin_settings("admin", "8642", kdf))
     if db.get_setting("pins_must_change") is None:
         db.set_setting("pins_must_change", "1")
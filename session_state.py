@@ -0,0 +1,61 @@
+
+from typing import Any, Dict, List, Optional
+
+# In-memory model of the open session: steps are loaded once, indexed by id and kept
+# in sync write-through with the DB - a change is applied to the records only once it is
+# committed (DB.after_commit), so a rolled back transaction leaves them as they were.
+# UI thread only; background jobs get a snapshot().
+
+STEP_FIELDS = ("id", "session_id", "block_index", "item_index", "text", "hint", "critical", "status",
+               "started_at", "completed_at", "duration_sec", "note", "override_by_master", "override_master_name")
+
+class StepRecord:
+    __slots__ = STEP_FIELDS
+
+    def __init__(self, row):
+        for f in STEP_FIELDS:
+            setattr(self, f, row[f])
+
+    # row-style access, so records can be passed wherever sqlite3.Row steps were used (pdf_report)
+    def __getitem__(self, key: str) -> Any:
+        return getattr(self, key)
+
+    def keys(self):
+        return STEP_FIELDS
+
+class SessionState:
+    def __init__(self, db, session_id: int):
+        self.db = db
+        self.session_id = session_id
+        self.steps: List[StepRecord] = [StepRecord(r) for r in db.get_steps(session_id)]
+        self.by_id: Dict[int, StepRecord] = {s.id: s for s in self.steps}
+        self.done_count = sum(1 for s in self.steps if s.status == "done")
+
+    def get(self, step_id: int) -> Optional[StepRecord]:
+        return self.by_id.get(step_id)
+
+    def set_status(self, step_id: int, new_status: str, note: Optional[str] = None) -> StepRecord:
+        st = self.by_id[step_id]
+        changes = self.db.update_step_status(step_id, new_status, note=note, prev=(st.status, st.started_at))
+        self.db.after_commit(lambda: self._apply(st, changes))
+        return st
+
+    def set_master_override(self, step_id: int, master_name: str):
+        self.db.set_step_master_override(step_id, master_name)
+        st = self.by_id[step_id]
+        self.db.after_commit(lambda: self._apply(st, {"override_by_master": 1, "override_master_name": master_name}))
+
+    def _apply(self, st: StepRecord, changes: Dict[str, Any]):
+        if st.status == "done":
+            self.done_count -= 1
+        for k, v in changes.items():
+            setattr(st, k, v)
+        if st.status == "done":
+            self.done_count += 1
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        # plain (JSON-serializable) copy of the steps for a background job
+        return [{f: getattr(s, f) for f in STEP_FIELDS} for s in self.steps]
+
+    def progress(self) -> float:
+        return self.done_count / max(1, len(self.steps))
@@ -0,0 +1,13 @@
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def db(tmp_path):
+    from db import DB
+    d = DB(str(tmp_path / "app.db"))
+    yield d
+    d.stop_log_writer()
+    d.conn.close()
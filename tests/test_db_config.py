@@ -0,0 +1,36 @@
+import pytest
+
+from db import DB
+
+def _reopen(db):
+    db.stop_log_writer()
+    db.conn.close()
+    return DB(db.path)
+
+def test_modes_come_from_settings(db):
+    assert (db.journal_mode, db.synchronous) == ("WAL", "NORMAL")
+    db.set_setting("db_journal_mode", "truncate")
+    db.set_setting("db_synchronous", "FULL")
+    db = _reopen(db)
+    try:
+        assert (db.journal_mode, db.synchronous) == ("TRUNCATE", "FULL")
+        assert db.conn.execute("PRAGMA synchronous").fetchone()[0] == 2
+    finally:
+        db.stop_log_writer()
+        db.conn.close()
+
+def test_bad_setting_falls_back_to_default(db):
+    db.set_setting("db_synchronous", "fast")
+    db = _reopen(db)
+    try:
+        assert db.synchronous == "NORMAL"
+        db.flush_logs()
+        row = db.conn.execute("SELECT level, action, details FROM logs ORDER BY id DESC LIMIT 1").fetchone()
+        assert (row["level"], row["action"]) == ("WARN", "db_config") and "FAST" in row["details"]
+    finally:
+        db.stop_log_writer()
+        db.conn.close()
+
+def test_explicit_mode_is_validated(tmp_path):
+    with pytest.raises(ValueError):
+        DB(str(tmp_path / "app.db"), synchronous="fast")
@@ -0,0 +1,55 @@
+import os, sqlite3, time
+
+import pytest
+
+def _actions(path):
+    other = sqlite3.connect(path)
+    try:
+        return [r[0] for r in other.execute("SELECT action FROM logs ORDER BY id")]
+    finally:
+        other.close()
+
+@pytest.fixture
+def fsynced(monkeypatch):
+    # paths of the files fsynced through db.os
+    import db as db_module
+    paths = []
+    fsync = db_module.os.fsync
+    monkeypatch.setattr(db_module.os, "fsync", lambda fd: (paths.append(os.readlink(f"/proc/self/fd/{fd}")), fsync(fd)))
+    return paths
+
+def test_audit_committed_before_log_returns(db, fsynced):
+    db.log("INFO", "buffered", {})
+    db.log("AUDIT", "pin_change", {"role": "admin"})
+    # visible to another connection, buffered rows before it are written too
+    assert _actions(db.path) == ["buffered", "pin_change"]
+    # synced: nothing of it is left only in the page cache
+    assert fsynced == [os.path.realpath(db.path + "-wal")]
+
+def test_audit_does_not_wait_for_readers(db, fsynced):
+    db.log("AUDIT", "before", {})
+    reader = sqlite3.connect(db.path)
+    try:
+        # a read transaction pinning the current snapshot (e.g. a long export)
+        reader.execute("BEGIN")
+        reader.execute("SELECT count(*) FROM logs").fetchone()
+        start = time.monotonic()
+        db.log("AUDIT", "pin_change", {"role": "admin"})
+        assert time.monotonic() - start < 1.0
+    finally:
+        reader.close()
+    assert _actions(db.path) == ["before", "pin_change"]
+    assert len(fsynced) == 2
+
+def test_audit_inside_transaction_follows_the_unit(db):
+    with db.transaction():
+        db.log("AUDIT", "critical_override", {"step_id": 1})
+        assert _actions(db.path) == []
+    assert _actions(db.path) == ["critical_override"]
+
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.log("AUDIT", "rolled_back", {})
+            raise RuntimeError()
+    db.log("AUDIT", "after", {})
+    assert _actions(db.path) == ["critical_override", "after"]
@@ -0,0 +1,11 @@
+def _report(db, order_no):
+    session_id = db.create_session(order_no, "operator")
+    db.add_report(session_id, 1, f"/reports/{order_no}.pdf")
+
+def test_query_without_words_filters_by_order_no(db):
+    _report(db, "A-100")
+    _report(db, "B200")
+    assert [r["order_no"] for r in db.list_reports("-")] == ["A-100"]
+    assert db.list_reports("/") == []
+    assert [r["order_no"] for r in db.list_reports("b20")] == ["B200"]
+    assert len(db.list_reports("")) == 2
@@ -0,0 +1,15 @@
+from db import INGEST_MAX_ATTEMPTS
+
+def test_failing_photo_leaves_the_ingest_queue(db):
+    session_id = db.create_session("A-100", "operator")
+    db.conn.execute("INSERT INTO steps(session_id, block_index, item_index, text, critical) VALUES(?,0,0,'step',0)",
+                    (session_id,))
+    step_id = db.conn.execute("SELECT id FROM steps").fetchone()[0]
+    photo_id = db.add_photo(step_id, "/nonexistent/photo.jpg")
+    for _ in range(INGEST_MAX_ATTEMPTS - 1):
+        db.set_photo_ingest_failed(photo_id, "cannot identify image file")
+        assert [r["id"] for r in db.get_photos_pending_ingest()] == [photo_id]
+    db.set_photo_ingest_failed(photo_id, "cannot identify image file")
+    assert db.get_photos_pending_ingest() == []
+    row = db.get_photo(photo_id)
+    assert (row["ingest_attempts"], row["ingest_error"]) == (INGEST_MAX_ATTEMPTS, "cannot identify image file")
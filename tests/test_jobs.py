@@ -0,0 +1,19 @@
+import json, threading
+
+from jobs import JobExecutor
+
+def test_transient_kwargs_reach_the_handler_but_not_the_jobs_table(db):
+    seen = []
+    done = threading.Event()
+    executor = JobExecutor(db, workers=1)
+    executor.register("report", lambda job, session_id, steps=None: seen.append((session_id, steps)) or {})
+    executor.start()
+    try:
+        steps = [{"id": 1, "text": "long checklist text"}]
+        job_id = executor.submit("report", {"session_id": 7}, transient={"steps": steps},
+                                 on_done=lambda result: done.set())
+        assert done.wait(5)
+    finally:
+        executor.stop()
+    assert seen == [(7, steps)]
+    assert json.loads(db.get_job(job_id)["params"]) == {"session_id": 7}
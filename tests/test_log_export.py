@@ -0,0 +1,34 @@
+import csv, time
+
+from db import DB
+from log_export import export_logs
+
+def test_writes_go_on_during_export(tmp_path):
+    # rollback journal: an open read transaction would lock writers out
+    db = DB(str(tmp_path / "app.db"), journal_mode="DELETE")
+    try:
+        for i in range(1200):
+            db.log("INFO", "row", {"n": i})
+        db.flush_logs()
+        ids = []
+        for r in db.iter_logs(actions=["row"], batch_size=500):
+            if not ids:
+                start = time.monotonic()
+                db.set_setting("email_enabled", "1")
+                db.log("INFO", "row", {"n": "during export"})
+                db.flush_logs()
+                assert time.monotonic() - start < 1.0
+            ids.append(r["id"])
+        assert len(ids) == 1200 and ids == sorted(ids, reverse=True)
+    finally:
+        db.stop_log_writer()
+        db.conn.close()
+
+def test_export_filters_and_counts(db, tmp_path):
+    for level in ("INFO", "ERROR", "INFO"):
+        db.log(level, "email_send", {})
+    path = str(tmp_path / "logs.csv")
+    assert export_logs(db, path, levels=["INFO"], batch_size=1) == 2
+    with open(path, encoding="utf-8") as f:
+        rows = list(csv.reader(f, delimiter=";"))
+    assert [r[1] for r in rows[1:]] == ["INFO", "INFO"]
@@ -0,0 +1,177 @@
+import socketserver, threading, time
+
+import pytest
+
+from outbox import MailSender
+
+class FakeSMTP(socketserver.ThreadingTCPServer):
+    # Minimal SMTP server: EHLO with AUTH PLAIN, MAIL/RCPT/DATA, RSET, NOOP, QUIT.
+    # `replies` maps a command ("AUTH", "RCPT", "DATA") to a list of reply lines used
+    # (and consumed) one per command before the normal answer applies again.
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _SMTPHandler)
+        self.connections = 0
+        self.messages = []
+        self.replies = {}
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def reply_for(self, command, default):
+        queue = self.replies.get(command)
+        return queue.pop(0) if queue else default
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def send(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self.send("220 fake ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd = line.decode().strip().split(" ", 1)[0].upper()
+            if cmd == "EHLO":
+                self.send("250-fake")
+                self.send("250 AUTH PLAIN")
+            elif cmd == "AUTH":
+                self.send(server.reply_for("AUTH", "235 ok"))
+            elif cmd in ("MAIL", "RSET", "NOOP"):
+                self.send("250 ok")
+            elif cmd == "RCPT":
+                self.send(server.reply_for("RCPT", "250 ok"))
+            elif cmd == "DATA":
+                self.send("354 go on")
+                data = []
+                for raw in self.rfile:
+                    if raw == b".\r\n":
+                        break
+                    data.append(raw)
+                reply = server.reply_for("DATA", "250 queued")
+                if reply.startswith("250"):
+                    server.messages.append(b"".join(data))
+                self.send(reply)
+            elif cmd == "QUIT":
+                self.send("221 bye")
+                return
+            else:
+                self.send("502 not implemented")
+
+@pytest.fixture
+def smtp():
+    server = FakeSMTP()
+    yield server
+    server.close()
+
+@pytest.fixture
+def make_sender(db, smtp):
+    settings = {"smtp_host": "127.0.0.1", "smtp_port": str(smtp.server_address[1]), "smtp_user": "cnc@example.com",
+                "smtp_pass": "secret", "recipients": "master@example.com", "smtp_ssl": "0", "smtp_tls": "0"}
+    senders = []
+
+    def make(**kwargs):
+        events = []
+        sender = MailSender(db, lambda: settings, on_sent=lambda subject: events.append(("sent", subject)),
+                            on_error=lambda subject, err, retry_in: events.append(("error", subject, retry_in)),
+                            **kwargs)
+        senders.append(sender)
+        return sender, events
+
+    yield make
+    for sender in senders:
+        sender.stop()
+
+def _wait(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.01)
+
+def _row(db, mail_id):
+    with db.lock:
+        return db.conn.execute("SELECT * FROM outbox WHERE id=?", (mail_id,)).fetchone()
+
+def _due_now(db, mail_id):
+    # skip the backoff wait
+    with db.lock:
+        db.conn.execute("UPDATE outbox SET next_attempt_at=0 WHERE id=?", (mail_id,))
+        db.conn.commit()
+
+def test_queued_mail_shares_one_connection(db, smtp, make_sender):
+    sender, events = make_sender()
+    ids = [db.enqueue_mail(f"report {i}", "body", [], "email_send") for i in range(3)]
+    sender.start()
+    _wait(lambda: len(events) == 3)
+    assert [e[0] for e in events] == ["sent"] * 3
+    assert [_row(db, i)["status"] for i in ids] == ["sent"] * 3
+    assert len(smtp.messages) == 3
+    assert smtp.connections == 1
+
+def test_transient_failure_is_retried_with_backoff(db, smtp, make_sender):
+    smtp.replies["DATA"] = ["451 try later", "451 try later"]
+    sender, events = make_sender(base_delay=100, max_delay=150)
+    mail_id = sender.send("report", "body", [])
+    sender.start()
+    _wait(lambda: len(events) == 1)
+    row = _row(db, mail_id)
+    assert (row["status"], row["attempts"]) == ("queued", 1)
+    assert events[0] == ("error", "report", 100)
+    assert row["next_attempt_at"] >= int(time.time()) + 90
+
+    # second failure: delay doubled, capped at max_delay
+    _due_now(db, mail_id)
+    sender.wake()
+    _wait(lambda: len(events) == 2)
+    assert events[1] == ("error", "report", 150)
+
+    _due_now(db, mail_id)
+    sender.wake()
+    _wait(lambda: len(events) == 3)
+    row = _row(db, mail_id)
+    assert events[2] == ("sent", "report")
+    assert (row["status"], row["attempts"]) == ("sent", 3)
+
+def test_rejected_message_fails_without_retry(db, smtp, make_sender):
+    smtp.replies["RCPT"] = ["550 no such user"]
+    sender, events = make_sender(base_delay=0)
+    rejected = sender.send("rejected", "body", [])
+    missing = sender.send("missing attachment", "body", ["/nonexistent/report.pdf"])
+    sender.start()
+    _wait(lambda: len(events) == 2)
+    assert sorted(events) == [("error", "missing attachment", None), ("error", "rejected", None)]
+    assert _row(db, rejected)["status"] == "failed"
+    assert _row(db, missing)["status"] == "failed"
+    assert smtp.messages == []
+
+    # revived on request with a fresh attempt budget
+    assert sender.retry_now(include_failed=True) == 2
+    _wait(lambda: _row(db, rejected)["status"] == "sent")
+    assert _row(db, rejected)["attempts"] == 1
+
+def test_auth_failure_keeps_mail_queued(db, smtp, make_sender):
+    smtp.replies["AUTH"] = ["535 bad credentials"]
+    sender, events = make_sender(base_delay=100)
+    mail_id = sender.send("report", "body", [])
+    sender.start()
+    _wait(lambda: len(events) == 1)
+    assert events[0] == ("error", "report", 100)
+    assert _row(db, mail_id)["status"] == "queued"
+
+def test_gives_up_after_max_attempts(db, smtp, make_sender):
+    smtp.replies["DATA"] = ["451 try later"] * 3
+    sender, events = make_sender(base_delay=0, max_attempts=3)
+    mail_id = sender.send("report", "body", [])
+    sender.start()
+    _wait(lambda: len(events) == 3)
+    assert events == [("error", "report", 0), ("error", "report", 0), ("error", "report", None)]
+    row = _row(db, mail_id)
+    assert (row["status"], row["attempts"]) == ("failed", 3)
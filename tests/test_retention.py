@@ -0,0 +1,38 @@
+import sqlite3
+
+import pytest
+
+from db import DB
+from retention import DEFAULT_LOG_DAYS, _policy
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    # database file created before auto_vacuum was turned on
+    path = tmp_path / "app.db"
+    conn = sqlite3.connect(str(path))
+    conn.execute("CREATE TABLE filler (data BLOB)")
+    conn.executemany("INSERT INTO filler VALUES (?)", [(b"x" * 4096,) for _ in range(200)])
+    conn.commit()
+    conn.execute("DELETE FROM filler")
+    conn.commit()
+    conn.close()
+    d = DB(str(path))
+    yield d
+    d.stop_log_writer()
+    d.conn.close()
+
+def test_policy_falls_back_on_bad_value(legacy_db):
+    legacy_db.set_setting("retention_log_days", "полгода")
+    assert _policy(legacy_db, "retention_log_days", DEFAULT_LOG_DAYS) == DEFAULT_LOG_DAYS
+    legacy_db.flush_logs()
+    row = legacy_db.conn.execute("SELECT level, action FROM logs ORDER BY id DESC LIMIT 1").fetchone()
+    assert tuple(row) == ("WARN", "retention_policy")
+    legacy_db.set_setting("retention_log_days", "0")
+    assert _policy(legacy_db, "retention_log_days", DEFAULT_LOG_DAYS) == 0
+
+def test_full_vacuum_only_on_request(legacy_db):
+    assert legacy_db.needs_full_vacuum()
+    legacy_db.reclaim_space()
+    assert legacy_db.needs_full_vacuum()
+    assert legacy_db.reclaim_space(full=True) > 0
+    assert not legacy_db.needs_full_vacuum()
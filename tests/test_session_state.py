@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from checklist_loader import load_checklist
+from session_state import SessionState
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def state(db):
+    session_id = db.create_session("A-100", "operator")
+    db.ensure_steps_for_session(session_id, load_checklist(os.path.join(ROOT, "checklist.json")))
+    return SessionState(db, session_id)
+
+def test_rolled_back_change_leaves_records_untouched(db, state):
+    st = state.steps[0]
+    before = dict(state.snapshot()[0])
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            state.set_status(st.id, "failed")
+            state.set_master_override(st.id, "master")
+            assert st.status == before["status"]  # not committed yet
+            raise RuntimeError()
+    assert state.snapshot()[0] == before
+    assert SessionState(db, state.session_id).snapshot()[0] == before
+
+def test_committed_change_is_applied(db, state):
+    st = state.steps[0]
+    with db.transaction():
+        state.set_status(st.id, "failed")
+        state.set_master_override(st.id, "master")
+    assert (st.status, st.override_by_master, st.override_master_name) == ("failed", 1, "master")
+    state.set_status(st.id, "done")
+    assert st.status == "done" and state.done_count == 1
+    assert state.snapshot()[0]["status"] == "done"
+
+def test_rolled_back_template_is_not_reused(db):
+    checklist = load_checklist(os.path.join(ROOT, "checklist.json"))
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            session_id = db.create_session("A-100", "operator")
+            db.ensure_steps_for_session(session_id, checklist)
+            raise RuntimeError()
+    session_id = db.create_session("A-101", "operator")
+    db.ensure_steps_for_session(session_id, checklist)
+    assert len(db.get_steps(session_id)) == len(checklist.items)
@@ -0,0 +1,65 @@
+"""Write-latency benchmark for DB durability modes.
+
+Runs the checklist hot path (status change, master override = update + override + log)
+against a throw-away database for each journal_mode/synchronous pair, with and
+without DB.transaction() grouping.
+
+    python tools/bench_db.py [--steps 200] [--dir /sdcard/tmp]
+
+Run it on the target tablet: the numbers depend on the storage (eMMC fsync cost).
+"""
+import argparse, os, shutil, statistics, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db import DB
+from checklist_loader import load_checklist
+
+MODES = [("DELETE", "FULL"), ("WAL", "FULL"), ("WAL", "NORMAL")]
+
+def _checklist():
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "checklist.json")
+    return load_checklist(path)
+
+def _bench(db, session_id, n, grouped):
+    step_ids = [r["id"] for r in db.get_steps(session_id)]
+    lat = []
+    for i in range(n):
+        step_id = step_ids[i % len(step_ids)]
+        t0 = time.perf_counter()
+        if grouped:
+            with db.transaction():
+                db.update_step_status(step_id, "failed")
+                db.set_step_master_override(step_id, "bench")
+                db.log("AUDIT", "critical_override", {"step_id": step_id, "master_name": "bench"})
+        else:
+            db.update_step_status(step_id, "failed")
+            db.set_step_master_override(step_id, "bench")
+            db.log("AUDIT", "critical_override", {"step_id": step_id, "master_name": "bench"})
+        lat.append((time.perf_counter() - t0) * 1000.0)
+    return lat
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--steps", type=int, default=200, help="override operations per mode")
+    ap.add_argument("--dir", default=None, help="directory for the temporary databases (use the app's storage)")
+    args = ap.parse_args()
+    checklist = _checklist()
+    tmp = tempfile.mkdtemp(prefix="bench_db_", dir=args.dir)
+    try:
+        print(f"{'journal':8} {'sync':7} {'grouped':8} {'mean ms':>8} {'p95 ms':>8} {'ops/s':>8}")
+        for journal_mode, synchronous in MODES:
+            for grouped in (False, True):
+                path = os.path.join(tmp, f"{journal_mode}_{synchronous}_{int(grouped)}.db")
+                db = DB(path, journal_mode=journal_mode, synchronous=synchronous)
+                sid = db.create_session("BENCH", "bench")
+                db.ensure_steps_for_session(sid, checklist)
+                lat = _bench(db, sid, args.steps, grouped)
+                db.conn.close()
+                p95 = sorted(lat)[int(0.95 * (len(lat) - 1))]
+                mean = statistics.mean(lat)
+                print(f"{journal_mode:8} {synchronous:7} {str(grouped):8} {mean:8.2f} {p95:8.2f} {1000.0 / mean:8.0f}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Cold-start benchmark: time of each import/initialisation phase of the app.
+
+Every phase runs in a fresh interpreter, so nothing is warm from a previous phase.
+Its prerequisites are imported first and left out of the timing. The report shows the
+median of --runs, the wall time of the whole process (interpreter start, prerequisites,
+phase) and the heavy modules that got loaded together with `main`.
+Those should stay deferred until session finish.
+
+    python tools/bench_startup.py [--runs 5] [--dir /sdcard/tmp]
+
+Kivy phases run headless (SDL dummy video driver, mock GL). A phase whose dependency
+is missing is reported as skipped.
+"""
+import argparse, os, shutil, statistics, subprocess, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+KIVY_IMPORTS = "import kivy.clock, kivy.lang, kivy.metrics, kivy.properties"
+KIVYMD_IMPORTS = """
+import kivymd.app, kivymd.uix.list, kivymd.uix.dialog, kivymd.uix.button, kivymd.uix.boxlayout
+import kivymd.uix.snackbar, kivymd.uix.label, kivymd.uix.progressbar
+"""
+APP_IMPORTS = "import db, security, jobs, photo_cache, session_state, log_export, retention, checklist_loader"
+
+# name, timed code, prerequisite code (untimed)
+PHASES = [
+    ("kivy", KIVY_IMPORTS, ""),
+    ("kivymd", KIVYMD_IMPORTS, KIVY_IMPORTS),
+    ("app modules", APP_IMPORTS, ""),
+    ("main", "import main", ""),
+    ("db open (new)", "db.DB(os.path.join(WORK, 'new.db'))", APP_IMPORTS),
+    ("db open (existing)", "db.DB(os.path.join(WORK, 'old.db'))",
+     APP_IMPORTS + "\ndb.DB(os.path.join(WORK, 'old.db')).conn.close()"),
+    ("checklist (cold)", "checklist_loader.load_checklist(CHECKLIST, os.path.join(WORK, 'cold.pickle'))",
+     APP_IMPORTS),
+    ("checklist (cached)", "checklist_loader.load_checklist(CHECKLIST, os.path.join(WORK, 'warm.pickle'))",
+     APP_IMPORTS + "\nchecklist_loader.load_checklist(CHECKLIST, os.path.join(WORK, 'warm.pickle'))"),
+    ("deferred: pdf_report", "import pdf_report", APP_IMPORTS),
+    ("deferred: photo_ingest", "import photo_ingest", APP_IMPORTS),
+    ("deferred: email_utils", "import email_utils", APP_IMPORTS),
+]
+
+HEAVY_MODULES = ("reportlab", "PIL", "smtplib", "email_utils", "pdf_report", "photo_ingest")
+
+SCRIPT = """
+import os, sys, time
+sys.path.insert(0, {root!r})
+WORK = {work!r}
+CHECKLIST = os.path.join({root!r}, "checklist.json")
+os.chdir({root!r})
+{setup}
+t0 = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - t0
+print("elapsed", elapsed)
+print("heavy", ",".join(m for m in {heavy!r} if m in sys.modules))
+"""
+
+def _env():
+    env = dict(os.environ)
+    env.update({"KIVY_NO_ARGS": "1", "KIVY_NO_CONSOLELOG": "1", "KIVY_NO_FILELOG": "1",
+                "KIVY_GL_BACKEND": "mock", "SDL_VIDEODRIVER": "dummy"})
+    return env
+
+def _run_phase(code, setup, work):
+    # fresh work dir per run: "new" DB and "cold" cache must not exist yet
+    shutil.rmtree(work, ignore_errors=True)
+    os.makedirs(work)
+    script = SCRIPT.format(root=ROOT, work=work, setup=setup, code=code, heavy=HEAVY_MODULES)
+    t0 = time.perf_counter()
+    p = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, env=_env(), cwd=ROOT)
+    if p.returncode != 0:
+        last = (p.stderr.strip().splitlines() or ["failed"])[-1]
+        raise RuntimeError(last)
+    wall = (time.perf_counter() - t0) * 1000.0
+    out = dict(line.split(" ", 1) if " " in line else (line, "") for line in p.stdout.splitlines()
+               if line.startswith(("elapsed", "heavy")))
+    return float(out["elapsed"]) * 1000.0, wall, [m for m in out.get("heavy", "").split(",") if m]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5, help="fresh interpreters per phase")
+    ap.add_argument("--dir", default=None, help="directory for the temporary files (use the app's storage)")
+    args = ap.parse_args()
+    tmp = tempfile.mkdtemp(prefix="bench_startup_", dir=args.dir)
+    try:
+        print(f"{'phase':24} {'median ms':>10} {'min ms':>8} {'process ms':>11}  heavy modules loaded")
+        for name, code, setup in PHASES:
+            try:
+                results = [_run_phase(code, setup, os.path.join(tmp, "work")) for _ in range(max(1, args.runs))]
+            except RuntimeError as e:
+                print(f"{name:24} {'skipped':>10} {'':8} {'':11}  {e}")
+                continue
+            lat = [ms for ms, _, _ in results]
+            wall = statistics.median(w for _, w, _ in results)
+            heavy = ",".join(results[-1][2]) or "-"
+            print(f"{name:24} {statistics.median(lat):10.1f} {min(lat):8.1f} {wall:11.1f}  {heavy}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()